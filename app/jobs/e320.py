@@ -1,27 +1,40 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
-import json
-from urllib.request import urlopen
-from library.sql import Sql
+from library.e320_telemetry import e320_telemetry
+from library.http_session import http_session
+from library.ring_buffer import rings
 
 
 class E320():
 
+    URL = "http://192.168.178.79/cm?cmnd=status+10"
+
     @staticmethod
-    def fetch(database):
-        sql = Sql()
+    async def fetch(write_buffer):
         logger = logging.getLogger("E320")
         try:
-            with urlopen("http://192.168.178.79/cm?cmnd=status+10") as response:
-                data = json.loads(response.read().decode("utf-8"))
-                
+            if not e320_telemetry.is_fresh():
+                # no telemetry, poll the device like before; the reading joins
+                # the minute aggregates so a switch-over stores no minute twice
+                async with http_session.get().get(E320.URL) as response:
+                    data = await response.json(content_type=None)
+
                 e_in = data['StatusSNS']['E320']['E_in']
                 e_out = data['StatusSNS']['E320']['E_out']
                 power = data['StatusSNS']['E320']['Power']
-                
-                insert_stmt = sql.generate_e320_insert_stmt(e_in, e_out, power)
-                database.execute(insert_stmt)
+                e320_telemetry.add(e_in, e_out, power)
+
+            # minutes finished since the last run
+            aggregates = e320_telemetry.drain()
+            if aggregates:
+                # add_many() may flush the buffer to Postgres
+                await asyncio.to_thread(write_buffer.add_many, aggregates)
+                for aggregate in aggregates:
+                    rings.record(aggregate)
+            return aggregates
         except Exception as e:
-            logger.error("Error: %s. Cannot get E320 data." % e)
\ No newline at end of file
+            logger.error("Error: %s. Cannot get E320 data." % e)
+            return None
@@ -1,43 +1,74 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
-from fritzconnection import FritzConnection
-from fritzconnection.lib.fritzhomeauto import FritzHomeAutomation
+import xml.etree.ElementTree as ET
+from datetime import datetime as dt
 from library.Configuration import Configuration
-from library.sql import Sql
+from library.fritz_session import fritz_session
+from library.latest_values import latest_values
+from library.ring_buffer import rings
+from library.samples import DeviceSample, SolarpanelSample
 
 
 class HomeAutomation:
+
+    @staticmethod
+    def _number(element, path, divisor):
+        text = element.findtext(path)
+        if text is None or not text.strip().lstrip("-").isdigit():
+            return None
+        return int(text) / divisor
+
+    @staticmethod
+    def parse_devices(content, timestamp):
+        """One DeviceSample per device of a getdevicelistinfos answer (groups are skipped)."""
+        samples = []
+        for device in ET.fromstring(content).iter("device"):
+            samples.append(DeviceSample(
+                timestamp,
+                device.get("identifier", "").replace(" ", ""),
+                (device.findtext("name") or "").strip(),
+                1 if device.findtext("present") == "1" else 0,
+                # powermeter: mW and Wh, temperature: 0.1 °C
+                HomeAutomation._number(device, "powermeter/power", 1000),
+                HomeAutomation._number(device, "powermeter/energy", 1),
+                HomeAutomation._number(device, "temperature/celsius", 10),
+            ))
+        return samples
+
     @staticmethod
-    def fetch(database):
+    async def fetch(write_buffer):
         config = Configuration()
-        insert = ""
-        sql = Sql()
         logger = logging.getLogger("HomeAutomation")
-
-        def get_garage_data():
-            fc = FritzConnection(
-                address=config.fritz_api_ip(),
-                user=config.fritz_api_user(),
-                password=config.fritz_api_pass(),
-            )
-            fh = FritzHomeAutomation(fc)
-            return fh.get_device_information_by_identifier(
-                config.fritz_garage_solar_ain()
-            )
+        garage_ain = (config.fritz_garage_solar_ain() or "").replace(" ", "")
 
         try:
-            garage_solar_socket = get_garage_data()
-
-            garage_temp = garage_solar_socket["NewTemperatureCelsius"] * 0.1
-            overall_status = 0
-            if garage_solar_socket["NewPresent"] == "CONNECTED":
-                overall_status = 1
-            garage_power = garage_solar_socket["NewMultimeterPower"] / 100
-            insert = sql.generate_solarpanel_insert_stmt(
-                garage_temp, overall_status, garage_power
+            # One AHA request returns every DECT device; fritzconnection is
+            # blocking, keep it off the event loop
+            answer = await asyncio.to_thread(
+                fritz_session.call, lambda fc: fc.call_http("getdevicelistinfos")
             )
-            database.execute(insert)
+            timestamp = dt.now().astimezone()
+            devices = HomeAutomation.parse_devices(answer["content"], timestamp)
+            samples = list(devices)
+
+            garage = next((device for device in devices if device.ain == garage_ain), None)
+            solar = None
+            if garage is not None:
+                solar = SolarpanelSample(
+                    timestamp, garage.temperature or 0.0, garage.present, garage.power or 0.0
+                )
+                samples.append(solar)
+            else:
+                logger.warning(f"Garage solar socket {garage_ain} not in the device list")
+
+            await asyncio.to_thread(write_buffer.add_many, samples)
+            if solar is not None:
+                latest_values.update(solar)
+                rings.record(solar)
+            return samples or None
         except Exception as e:
             logger.error("Error: %s. Cannot get HomeAutomation data." % e)
+            return None
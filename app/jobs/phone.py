@@ -1,53 +1,133 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
+from datetime import datetime as dt, timedelta
 from library.fritzbox import Fritzbox
 from library.sql import Sql
+from library.timerange import LOCAL_TZ
 
 
 class Phone():
 
+    # ids of calls that were still active, the next run has to reach back to them
+    _active_ids = set()
+    # numbers whose failed lookup is retried per run, the rate limit allows few
+    RESOLVE_PER_RUN = 5
+
     @staticmethod
-    def fetch(database):
+    async def fetch(database):
+        # database is an AsyncDatabase
         sql = Sql()
         logger = logging.getLogger("Phone")
         try:
             fbox = Fritzbox()
-            
-            # Fetch all calls from Fritzbox API
-            all_calls = fbox.get_call_history()
-            last_known_id = 0
-            
-            # Get the last known call ID from database to avoid duplicates
-            last_call_query = 'SELECT call_id FROM phone_calls ORDER BY "timestamp" DESC LIMIT 1;'
-            records = database.read(last_call_query)
-            if records and len(records) > 0:
-                last_known_id = records[0][0]
-            
-            # Process all calls from the API
+
+            # Only calls newer than the newest stored one, and only calls inside
+            # the retention window since older ones have no partition to go to
+            retention_days = sql.PARTITIONED_TABLES["phone_calls"]
+            records = await database.read(sql.generate_phone_calls_last_call_id_query(), primary=True)
+            since_id = records[0][0] if records and records[0][0] else None
+            if since_id and Phone._active_ids:
+                since_id = min(since_id, min(Phone._active_ids) - 1)
+            all_calls = await asyncio.to_thread(
+                fbox.get_call_history, since_id=since_id, days=retention_days + 1
+            )
+
+            since = dt.now(LOCAL_TZ) - timedelta(days=retention_days)
+
+            calls = {}
+            active_ids = set()
             for call in all_calls:
-                # Only process new calls that we haven't seen before
-                if call['id'] > last_known_id:
-                    # Check if this specific call ID already exists in database
-                    check_query = f"SELECT call_id FROM phone_calls WHERE call_id = {call["id"]};"
-                    existing_records = database.read(check_query)
-                    
-                    # Only insert if this call ID doesn't already exist
-                    if not existing_records or len(existing_records) == 0:
-                        # Perform reverse lookup if name is not available
-                        if (call['name'] is None and call['caller']) or (len(call['name']) == 0 and call['caller']):
-                            call['name'] = Fritzbox.telefonbuch_reverse_lookup(call['caller'])
-                        
-                        # Persist the call to database
-                        insert_stmt = sql.generate_phone_calls_insert_stmt(
-                            call['id'],
-                            call['caller'] if call['caller'] else '',
-                            call['name'] if call['name'] else '',
-                            call['date'],
-                            call['duration']
-                        )
-                        database.execute(insert_stmt)
-                    
+                # an active call has no final duration yet, the next run picks it up
+                if call['type'] == 9:
+                    active_ids.add(call['id'])
+                    continue
+                timestamp = Fritzbox.parse_call_date(call['date'])
+                if timestamp is not None and timestamp >= since:
+                    calls[call['id']] = (timestamp, call)
+            Phone._active_ids = active_ids
+            if calls:
+                await Phone.store_calls(database, calls, since)
+            # after storing, so rate-limited lookups cannot hold back the calls
+            await Phone.resolve_names(database, since)
+            # last, so it also catches monitor rows written while this run was busy
+            await Phone.reconcile_monitored(database, since)
+
         except Exception as e:
-            logger.error("Error: %s. Cannot get Fritzbox phone data." % e)
\ No newline at end of file
+            logger.error("Error: %s. Cannot get Fritzbox phone data." % e)
+
+    @staticmethod
+    async def store_calls(database, calls, since):
+        """Insert new calls (call id -> (timestamp, call)), or complete their call monitor rows."""
+        sql = Sql()
+        logger = logging.getLogger("Phone")
+        # One query for the whole list instead of one per call
+        records = await database.read(sql.generate_phone_calls_known_ids_query(calls.keys()), primary=True)
+        if records is None:
+            logger.warning("Cannot read known calls, skipping this run")
+            return
+        known_ids = {record[0] for record in records}
+
+        # Calls the call monitor already stored, still without a call_id
+        unmatched = await database.read(sql.generate_phone_calls_unmatched_query(since), primary=True) or []
+
+        rows = []
+        matches = []
+        for call_id, (timestamp, call) in sorted(calls.items()):
+            if call_id in known_ids:
+                continue
+            match = Phone.match_monitored(unmatched, timestamp, call['caller'])
+            if match is not None:
+                unmatched.remove(match)
+                row_id, row_timestamp, _, row_name = match
+                matches.append((row_id, row_timestamp, call_id, call['name'] or row_name, call['duration']))
+                continue
+            # Unknown callers are stored with a NULL name, resolve_names looks
+            # them up afterwards within the rate limit
+            name = (call['name'] or None) if call['caller'] else ''
+            rows.append((timestamp, call_id, call['caller'] or '', name, call['date'], call['duration']))
+
+        if rows:
+            # ON CONFLICT guards against a concurrent run storing the same call
+            await database.execute_values(sql.generate_phone_calls_bulk_insert_stmt(), rows)
+            logger.info(f"Stored {len(rows)} new calls")
+        if matches:
+            await database.execute_values(sql.generate_phone_calls_match_stmt(), matches)
+            logger.info(f"Matched {len(matches)} calls recorded by the call monitor")
+
+    @staticmethod
+    async def reconcile_monitored(database, since):
+        """
+        Drop call monitor rows whose call was stored from the call list as
+        well. The monitor can write a row after store_calls read the
+        unmatched ones, and the unique index does not cover NULL call ids.
+        """
+        sql = Sql()
+        await database.execute(sql.generate_phone_calls_reconcile_stmt(), (since,))
+
+    @staticmethod
+    async def resolve_names(database, since):
+        """Retry the reverse lookups of stored calls whose name is still NULL."""
+        sql = Sql()
+        logger = logging.getLogger("Phone")
+        records = await database.read(
+            sql.generate_phone_calls_unnamed_numbers_query(since, Phone.RESOLVE_PER_RUN), primary=True
+        )
+        names = []
+        for (number,) in records or []:
+            name = await asyncio.to_thread(Fritzbox.telefonbuch_reverse_lookup, number, 5)
+            if name is not None:
+                names.append((number, name))
+        if names:
+            await database.execute_values(sql.generate_phone_calls_names_update_stmt(), names)
+            logger.info(f"Resolved the names of {len(names)} callers")
+
+    @staticmethod
+    def match_monitored(unmatched, timestamp, caller):
+        """Monitor row of the same caller within a minute of timestamp, if any."""
+        for row in unmatched:
+            if row[2] == (caller or '') and abs((row[1] - timestamp).total_seconds()) <= 60:
+                return row
+        return None
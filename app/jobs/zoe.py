@@ -1,36 +1,90 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import logging
-import aiohttp
 import asyncio
+import logging
+import os
+from datetime import datetime as dt
 from library.Configuration import Configuration
+from library.http_session import http_session
+from renault_api.credential_store import FileCredentialStore
+from renault_api.exceptions import NotAuthenticatedException
+from renault_api.gigya import GIGYA_LOGIN_TOKEN
+from renault_api.kamereon.enums import ChargeState, PlugState
 from renault_api.renault_client import RenaultClient
-from library.sql import Sql
+from library.latest_values import latest_values
+from library.ring_buffer import rings
+from library.samples import ZoeSample
 
 
 class Zoe():
 
+    # Resolved vehicle handle, reused as long as the shared websession lives.
+    _vehicle = None
+    _websession = None
+    # "charging", "plugged" or "parked", drives the polling interval
+    state = None
+
     @staticmethod
-    async def renault_request(database):
-        insert = ""
-        sql = Sql()
-        try:
-            logger = logging.getLogger("Zoe")
+    def vehicle_state(battery_data):
+        if battery_data.get_charging_status() == ChargeState.CHARGE_IN_PROGRESS:
+            return "charging"
+        if battery_data.get_plug_status() == PlugState.PLUGGED:
+            return "plugged"
+        return "parked"
+
+    @staticmethod
+    def credential_path():
+        return os.path.abspath(Configuration().zoe_credential_store())
+
+    @staticmethod
+    async def login(session):
+        config = Configuration()
+        await session.login(config.zoe_username(), config.zoe_password())
+        os.chmod(Zoe.credential_path(), 0o600)
+
+    @staticmethod
+    async def vehicle():
+        websession = http_session.get()
+        if Zoe._vehicle is None or Zoe._websession is not websession:
             config = Configuration()
-            async with aiohttp.ClientSession() as websession:
-                client = RenaultClient(websession=websession, locale="de_DE")
-                await client.session.login(config.zoe_username(), config.zoe_password())
-                account = await client.get_api_account(config.zoe_account_id())
-                vehicle = await account.get_api_vehicle(config.zoe_vehicle_id())
-                cockpit_data = await vehicle.get_cockpit()
-                battery_data = await vehicle.get_battery_status()
-                insert = sql.generate_zoe_insert_stmt(battery_data.batteryLevel, cockpit_data.totalMileage)
-                logger.info(insert)
-                database.execute(insert)            
+            # Gigya login token, JWT and person id survive restarts in this file
+            store = FileCredentialStore(Zoe.credential_path())
+            client = RenaultClient(websession=websession, locale="de_DE", credential_store=store)
+            if GIGYA_LOGIN_TOKEN not in store:
+                await Zoe.login(client.session)
+            account = await client.get_api_account(config.zoe_account_id())
+            Zoe._vehicle = await account.get_api_vehicle(config.zoe_vehicle_id())
+            Zoe._websession = websession
+        return Zoe._vehicle
+
+    @staticmethod
+    async def read_vehicle(vehicle):
+        return await asyncio.gather(vehicle.get_cockpit(), vehicle.get_battery_status())
+
+    @staticmethod
+    async def renault_request(write_buffer):
+        logger = logging.getLogger("Zoe")
+        try:
+            vehicle = await Zoe.vehicle()
+            try:
+                cockpit_data, battery_data = await Zoe.read_vehicle(vehicle)
+            except NotAuthenticatedException:
+                # the login token expired, log in once more and retry
+                logger.info("Renault session expired, logging in again")
+                await Zoe.login(vehicle.session)
+                cockpit_data, battery_data = await Zoe.read_vehicle(vehicle)
+            sample = ZoeSample(dt.now().astimezone(), battery_data.batteryLevel, cockpit_data.totalMileage)
+            Zoe.state = Zoe.vehicle_state(battery_data)
+            logger.info(f"{sample} ({Zoe.state})")
+            await asyncio.to_thread(write_buffer.add, sample)
+            latest_values.update(sample)
+            rings.record(sample)
+            return sample
         except Exception as e:
             logger.error("Error: %s. Cannot get Zoe data." % e)
+            return None
 
     @staticmethod
-    def fetch(database):
-        asyncio.run(Zoe.renault_request(database))
+    async def fetch(write_buffer):
+        return await Zoe.renault_request(write_buffer)
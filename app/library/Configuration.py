@@ -24,6 +24,9 @@ class Configuration:
     def postgres_host(self):
         return os.getenv("POSTGRES_HOST")
 
+    def postgres_port(self):
+        return int(os.getenv("POSTGRES_PORT", "5433"))
+
     def fritz_api_ip(self):
         return os.getenv("FRITZ_API_IP")
 
@@ -33,6 +36,42 @@ class Configuration:
     def fritz_api_user(self):
         return os.getenv("FRITZ_API_USER")
 
+    def fritz_timeout(self):
+        return float(os.getenv("FRITZ_TIMEOUT", "10"))
+
+    def fritz_cache_directory(self):
+        # None keeps fritzconnection's default (~/.fritzconnection)
+        return os.getenv("FRITZ_CACHE_DIRECTORY")
+
+    def call_monitor_active(self):
+        return os.getenv("CALL_MONITOR_ACTIVE") == "true"
+
+    def call_monitor_port(self):
+        return int(os.getenv("CALL_MONITOR_PORT", "1012"))
+
+    def e320_mqtt_active(self):
+        return os.getenv("E320_MQTT_ACTIVE") == "true"
+
+    def mqtt_host(self):
+        return os.getenv("MQTT_HOST", "localhost")
+
+    def mqtt_port(self):
+        return int(os.getenv("MQTT_PORT", "1883"))
+
+    def mqtt_user(self):
+        return os.getenv("MQTT_USER")
+
+    def mqtt_pass(self):
+        return os.getenv("MQTT_PASS")
+
+    def e320_mqtt_topic(self):
+        # Tasmota telemetry of the smart meter reader, TelePeriod sets the rate
+        return os.getenv("E320_MQTT_TOPIC", "tele/e320/SENSOR")
+
+    def e320_mqtt_max_age(self):
+        # seconds without telemetry before the HTTP poller takes over again
+        return float(os.getenv("E320_MQTT_MAX_AGE", "120"))
+
     def fritz_garage_solar_ain(self):
         return os.getenv("FRITZ_GARAGE_SOLAR_AIN")
 
@@ -48,6 +87,21 @@ class Configuration:
     def zoe_vehicle_id(self):
         return os.getenv("ZOE_VEHICLE_ID")
 
+    def zoe_credential_store(self):
+        return os.getenv("ZOE_CREDENTIAL_STORE", "renault_credentials.json")
+
+    def reverse_lookup_cache_path(self):
+        return os.getenv("REVERSE_LOOKUP_CACHE_PATH", "reverse_lookup.sqlite3")
+
+    def reverse_lookup_hit_ttl_days(self):
+        return float(os.getenv("REVERSE_LOOKUP_HIT_TTL_DAYS", "30"))
+
+    def reverse_lookup_miss_ttl_hours(self):
+        return float(os.getenv("REVERSE_LOOKUP_MISS_TTL_HOURS", "24"))
+
+    def reverse_lookup_rate_per_minute(self):
+        return float(os.getenv("REVERSE_LOOKUP_RATE_PER_MINUTE", "6"))
+
     def openweathermap_api_key(self):
         return os.getenv("OPENWEATHERMAP_API_KEY")
 
@@ -70,3 +124,52 @@ class Configuration:
     def telegram_allowed_user_ids(self):
         raw = os.getenv("TELEGRAM_ALLOWED_USER_IDS", "")
         return [int(x.strip()) for x in raw.split(",") if x.strip()] if raw else []
+
+    def postgres_pool_min_size(self):
+        return int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+
+    def postgres_pool_max_size(self):
+        return int(os.getenv("POSTGRES_POOL_MAX_SIZE", "5"))
+
+    def postgres_pool_wait_warning(self):
+        return float(os.getenv("POSTGRES_POOL_WAIT_WARNING", "1.0"))
+
+    def postgres_read_replicas(self):
+        # "host[:port],host[:port]" of hot standbys that serve dashboard reads
+        raw = os.getenv("POSTGRES_READ_REPLICAS", "")
+        replicas = []
+        for entry in raw.split(","):
+            entry = entry.strip()
+            if entry:
+                host, _, port = entry.partition(":")
+                replicas.append((host, int(port or 5433)))
+        return replicas
+
+    def postgres_replica_max_lag(self):
+        return float(os.getenv("POSTGRES_REPLICA_MAX_LAG", "30"))
+
+    def postgres_replica_connect_timeout(self):
+        # seconds, an unreachable standby must not hold up the lag probe for long
+        return int(os.getenv("POSTGRES_REPLICA_CONNECT_TIMEOUT", "3"))
+
+    def postgres_slow_query_seconds(self):
+        return float(os.getenv("POSTGRES_SLOW_QUERY_SECONDS", "0.5"))
+
+    def write_buffer_max_rows(self):
+        return int(os.getenv("WRITE_BUFFER_MAX_ROWS", "50"))
+
+    def write_buffer_max_age(self):
+        return int(os.getenv("WRITE_BUFFER_MAX_AGE", "120"))
+
+    def rollup_rescan_ids(self):
+        # ids behind the watermark rolled up again, in case they committed late
+        return int(os.getenv("ROLLUP_RESCAN_IDS", "5000"))
+
+    def spool_path(self):
+        return os.getenv("SPOOL_PATH", "spool.sqlite3")
+
+    def export_max_concurrent(self):
+        return int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+    def export_fetch_size(self):
+        return int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
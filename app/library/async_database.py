@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+
+class AsyncDatabase():
+    """
+    Awaitable facade over the pooled Database. Every call runs on a worker
+    thread with its own pooled connection, so the event loop that serves
+    uvicorn and the Telegram bot never waits on a database round trip.
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+    async def execute(self, insert_statement, params=None):
+        return await asyncio.to_thread(self.database.execute, insert_statement, params)
+
+    async def execute_values(self, insert_statement, rows, page_size=500):
+        return await asyncio.to_thread(self.database.execute_values, insert_statement, rows, page_size)
+
+    async def read(self, select_statement, params=None, primary=False):
+        return await asyncio.to_thread(self.database.read, select_statement, params, primary)
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark: string-formatted INSERTs vs. the prepared solarpanel insert.
+
+Runs against a temporary copy of the solarpanels table, so it is safe to
+point at the live database:
+
+    python -m library.benchmark_inserts 2000
+"""
+
+import sys
+import time
+from datetime import datetime as dt
+
+from dotenv import load_dotenv
+
+from library.database import Database
+from library.sql import Sql
+
+
+def run(database, rows):
+    sql = Sql()
+    results = {}
+    with database.cursor() as cur:
+        cur.execute('CREATE TEMPORARY TABLE "solarpanels" (LIKE public."solarpanels" INCLUDING DEFAULTS);')
+
+        legacy = 'INSERT INTO "solarpanels" ("timestamp","temperature","status","power") VALUES (\'{}\', {}, {}, {});'
+        started = time.perf_counter()
+        for i in range(rows):
+            cur.execute(legacy.format(dt.now(), 20.0 + i % 10, 1, i * 0.5))
+        results["string_format"] = rows / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for i in range(rows):
+            database.run(cur, sql.generate_solarpanel_insert_stmt(20.0 + i % 10, 1, i * 0.5))
+        results["prepared"] = rows / (time.perf_counter() - started)
+
+        # the statement was planned against the temporary table
+        database.deallocate(cur, "solarpanel_insert")
+        cur.execute('DROP TABLE pg_temp."solarpanels";')
+    return results
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    database = Database()
+    try:
+        for path, rate in run(database, rows).items():
+            print(f"{path:>14}: {rate:8.0f} inserts/s")
+    finally:
+        database.close()
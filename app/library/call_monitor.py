@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import socket
+from datetime import datetime as dt
+
+from library.Configuration import Configuration
+from library.fritzbox import Fritzbox
+from library.sql import Sql
+from library.timerange import localize
+
+
+class CallMonitor():
+    """
+    Listens to the Fritzbox call monitor (TCP 1012, switched on by dialling
+    #96*5*) and stores incoming calls the moment they end. The rows carry no
+    call_id yet; the Phone job fills it in when it reconciles with the call
+    list, and stores whatever the monitor missed while disconnected.
+    """
+
+    MAX_BACKOFF = 60
+
+    def __init__(self, database, host=None, port=None):
+        # database is an AsyncDatabase
+        self.config = Configuration()
+        self.logger = logging.getLogger("CallMonitor")
+        self.database = database
+        self.sql = Sql()
+        self.host = host or self.config.fritz_api_ip() or "192.168.178.1"
+        self.port = port or self.config.call_monitor_port()
+        # connection id -> incoming call in progress
+        self._calls = {}
+
+    async def run(self):
+        backoff = 1
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as error:
+                self.logger.warning(f"Cannot connect to the call monitor at {self.host}:{self.port}: '{error}'")
+            else:
+                self.logger.info(f"Connected to the call monitor at {self.host}:{self.port}")
+                backoff = 1
+                # the box sends nothing while idle, keepalive detects a dead peer
+                sock = writer.get_extra_info("socket")
+                if sock is not None:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                try:
+                    await self.listen(reader)
+                except (OSError, asyncio.IncompleteReadError) as error:
+                    self.logger.warning(f"Call monitor connection lost: '{error}'")
+                except Exception as error:
+                    # e.g. an over-long line; the monitor must outlive it, so reconnect
+                    self.logger.error(f"Call monitor failed, reconnecting: '{error!r}'")
+                finally:
+                    writer.close()
+                self._calls.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    async def listen(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                self.logger.warning("Call monitor closed the connection")
+                return
+            call = self.handle(line.decode("utf-8", "replace").strip())
+            if call is not None:
+                await self.store(call)
+
+    def handle(self, line):
+        """Track one monitor line, return the finished incoming call if it ended."""
+        fields = line.split(";")
+        if len(fields) < 4:
+            return None
+        try:
+            timestamp = localize(dt.strptime(fields[0], "%d.%m.%y %H:%M:%S"))
+        except ValueError:
+            return None
+        event, connection_id = fields[1], fields[2]
+        if event == "RING":
+            # date;RING;id;caller;called;line;
+            self._calls[connection_id] = {"timestamp": timestamp, "caller": fields[3]}
+        elif event == "CALL":
+            # outgoing, only incoming calls are stored
+            self._calls.pop(connection_id, None)
+        elif event == "DISCONNECT":
+            # date;DISCONNECT;id;seconds;
+            call = self._calls.pop(connection_id, None)
+            if call is not None:
+                call["seconds"] = int(fields[3]) if fields[3].isdigit() else 0
+                return call
+        return None
+
+    async def store(self, call):
+        # minute resolution like the call list, so the Phone job can match it
+        timestamp = call["timestamp"].replace(second=0, microsecond=0)
+        minutes = (call["seconds"] + 59) // 60
+        name = ""
+        if call["caller"]:
+            # None when the lookup could not be done, the Phone job retries it
+            name = await asyncio.to_thread(Fritzbox.telefonbuch_reverse_lookup, call["caller"])
+        row = (
+            timestamp,
+            None,
+            call["caller"],
+            name,
+            timestamp.strftime("%d.%m.%y %H:%M"),
+            "{}:{:02d}".format(minutes // 60, minutes % 60),
+        )
+        try:
+            await self.database.execute_values(self.sql.generate_phone_calls_bulk_insert_stmt(), [row])
+            self.logger.info(f"Stored call from {call['caller'] or 'unknown'} at {timestamp:%H:%M}")
+        except Exception as error:
+            # the Phone job picks the call up from the call list
+            self.logger.error(f"Error storing call: '{error}'")
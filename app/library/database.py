@@ -1,95 +1,455 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import psycopg2
-from library.sql import Sql
+import itertools
 import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import connection as PgConnection, cursor as PgCursor
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from library.sql import Sql, Statement
+from library.partitions import Partitions
 from library.Configuration import Configuration
+from library.query_stats import query_stats
+
+
+# Errors that mean "the database is not reachable" rather than "this statement is wrong".
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+
+class TimedCursor(PgCursor):
+    """Cursor that reports the duration and row count of every statement to query_stats."""
+
+    def execute(self, query, vars=None):
+        if self.name is not None:
+            # named cursors only DECLARE here, Database.stream times the fetches
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            query_stats.record(query, time.perf_counter() - started, self.rowcount, failed)
+
+
+class PreparingConnection(PgConnection):
+    """psycopg2 connection that remembers which statements are prepared on its session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = TimedCursor
+
+
+class PoolStats():
+    """Checkouts and time spent waiting for a free connection of one pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def checkout(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def checkin(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def describe(self):
+        with self._lock:
+            return {
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "wait_avg_seconds": self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "wait_max_seconds": self.wait_max,
+            }
+
+
+class Replica():
+    """A hot standby that serves reads while its replay lag stays acceptable."""
+
+    def __init__(self, host, port, max_size):
+        self.host = host
+        self.port = port
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.stats = PoolStats()
+        # seconds behind the primary, None while unreachable or not yet checked
+        self.lag = None
+        self.checked = None
+        # the lag is probed on a background thread, one probe at a time
+        self.probing = False
+        self._probe_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return "{}:{}".format(self.host, self.port)
+
 
 class Database():
 
+    # how often a replica's replay lag is measured
+    LAG_CHECK_INTERVAL = 10
+
     def __init__(self):
         self.config = Configuration()
-        self.conn = psycopg2.connect(
-            host=self.config.postgres_host(),
-            port=5433, 
-            dbname=self.config.postgres_db(), 
-            user=self.config.postgres_user(), 
-            password=self.config.postgres_password(), 
-            target_session_attrs="read-write"
-        )
-
-    def execute(self, insert_statement):
-        cur = self.conn.cursor()
+        self.logger = logging.getLogger("Database")
+        self.min_size = self.config.postgres_pool_min_size()
+        self.max_size = self.config.postgres_pool_max_size()
+        # The pool is opened on first use, so an unreachable database at
+        # startup only delays the connection instead of disabling it.
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self.initialized = False
+        self.sql = Sql()
+        # ThreadedConnectionPool raises instead of waiting when it is exhausted,
+        # so the semaphore makes callers queue for a free connection.
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self.stats = PoolStats()
+        # Reads go to these standbys, inserts always stay on the primary.
+        self.replicas = [
+            Replica(host, port, self.max_size) for host, port in self.config.postgres_read_replicas()
+        ]
+        self.max_lag = self.config.postgres_replica_max_lag()
+        self._replica_turn = itertools.count()
+
+    def _get_pool(self, replica=None):
+        target = replica or self
+        with target._pool_lock:
+            if target.pool is None:
+                options = {}
+                if replica:
+                    options["connect_timeout"] = self.config.postgres_replica_connect_timeout()
+                target.pool = ThreadedConnectionPool(
+                    self.min_size,
+                    self.max_size,
+                    host=replica.host if replica else self.config.postgres_host(),
+                    port=replica.port if replica else self.config.postgres_port(),
+                    dbname=self.config.postgres_db(),
+                    user=self.config.postgres_user(),
+                    password=self.config.postgres_password(),
+                    target_session_attrs="any" if replica else "read-write",
+                    connection_factory=PreparingConnection,
+                    **options
+                )
+            return target.pool
+
+    @contextmanager
+    def connection(self, replica=None):
+        target = replica or self
+        started = time.monotonic()
+        target._slots.acquire()
+        waited = time.monotonic() - started
+        target.stats.checkout(waited)
+        if waited > self.config.postgres_pool_wait_warning():
+            pool_name = replica.name if replica else "the primary"
+            self.logger.warning(f"Waited {waited:.3f}s for a connection to {pool_name}")
+        pool = None
+        conn = None
+        broken = False
         try:
-            cur.execute(insert_statement)
-            self.conn.commit()
+            pool = self._get_pool(replica)
+            conn = pool.getconn()
+            yield conn
+        except Exception:
+            broken = conn is not None and conn.closed != 0
+            raise
+        finally:
+            if conn is not None:
+                pool.putconn(conn, close=broken)
+            target.stats.checkin()
+            target._slots.release()
+
+    @contextmanager
+    def cursor(self, replica=None):
+        with self.connection(replica) as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def pool_stats(self):
+        stats = {"min_size": self.min_size, "max_size": self.max_size}
+        stats.update(self.stats.describe())
+        stats["replicas"] = [
+            dict(
+                {"name": replica.name, "lag_seconds": replica.lag, "usable": self._usable(replica)},
+                **replica.stats.describe()
+            )
+            for replica in self.replicas
+        ]
+        return stats
+
+    def close(self):
+        for target in [self] + self.replicas:
+            with target._pool_lock:
+                if target.pool is not None:
+                    target.pool.closeall()
+                    target.pool = None
+
+    def _usable(self, replica):
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    def _check_lag(self, replica):
+        """Start a lag probe when one is due; reads go by the last result meanwhile."""
+        now = time.monotonic()
+        with replica._probe_lock:
+            if replica.probing:
+                return
+            if replica.checked is not None and now - replica.checked < self.LAG_CHECK_INTERVAL:
+                return
+            replica.probing = True
+            replica.checked = now
+        # off the read path: connecting to an unreachable standby takes a
+        # connect timeout, and the reads fall back to the primary meanwhile
+        threading.Thread(
+            target=self._probe_lag, args=(replica,), name="lag-{}".format(replica.name), daemon=True
+        ).start()
+
+    def _probe_lag(self, replica):
+        try:
+            with self.cursor(replica) as cur:
+                cur.execute(self.sql.generate_replication_lag_query())
+                replica.lag = float(cur.fetchone()[0])
+            if not self._usable(replica):
+                self.logger.warning(f"Replica {replica.name} is {replica.lag:.1f}s behind, reading from the primary")
         except Exception as error:
-            print(f"Error: '{error}'")
-            self.conn.rollback()
+            replica.lag = None
+            self.logger.warning(f"Replica {replica.name} not available: '{error}'")
         finally:
-            cur.close()
-    
-    def read(self, select_statement):
-        cur = None
+            with replica._probe_lock:
+                replica.probing = False
+
+    def _read_replica(self):
+        """Next replica (round robin) that is within max_lag, or None for the primary."""
+        if not self.replicas:
+            return None
+        turn = next(self._replica_turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(turn + offset) % len(self.replicas)]
+            self._check_lag(replica)
+            if self._usable(replica):
+                return replica
+        return None
+
+    def _replica_failed(self, replica, error):
+        # skip it until the next lag check succeeds
+        replica.lag = None
+        self.logger.warning(f"Read on replica {replica.name} failed, retrying on the primary: '{error}'")
+
+    def is_available(self):
+        try:
+            with self.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except Exception as error:
+            self.logger.warning(f"Database not available: '{error}'")
+            return False
+
+    def run(self, cur, statement, params=None):
+        """
+        Execute statement on a cursor from cursor(). For callers that need
+        several statements in one transaction; registered Statements are
+        prepared on the connection first.
+        """
+        if not isinstance(statement, Statement):
+            cur.execute(statement, params)
+            return
+        # PREPARE lives on the session, not the transaction, so each pooled
+        # connection parses and plans a registered statement only once.
+        prepared = cur.connection.prepared
+        if statement.name not in prepared:
+            cur.execute(self.sql.generate_prepare_stmt(statement.name))
+            prepared.add(statement.name)
+        cur.execute(statement.execute_stmt(), statement.params)
+
+    def deallocate(self, cur, name):
+        """Forget a prepared statement on the cursor's connection, e.g. after its tables changed."""
+        prepared = cur.connection.prepared
+        if name in prepared:
+            cur.execute(self.sql.generate_deallocate_stmt(name))
+            prepared.discard(name)
+
+    def execute(self, insert_statement, params=None):
+        try:
+            with self.cursor() as cur:
+                self.run(cur, insert_statement, params)
+        except Exception as error:
+            self.logger.error(f"Error executing statement: '{error}'")
+
+    def execute_values(self, insert_statement, rows, page_size=500):
+        # Raises on failure so the caller can keep the rows for a retry.
+        with self.cursor() as cur:
+            execute_values(cur, insert_statement, rows, page_size=page_size)
+
+    def insert_each(self, samples):
+        """
+        Insert samples one by one behind savepoints, in one transaction, and
+        return (index, error) of those Postgres rejects. Raises on connection
+        errors, like execute_values.
+        """
+        failures = []
+        with self.cursor() as cur:
+            for index, sample in enumerate(samples):
+                statement = self.sql.generate_bulk_insert_stmt(sample.table, type(sample)._fields)
+                cur.execute(self.sql.generate_savepoint_stmt("sample_row"))
+                try:
+                    execute_values(cur, statement, [sample])
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as error:
+                    cur.execute(self.sql.generate_rollback_to_savepoint_stmt("sample_row"))
+                    failures.append((index, str(error).strip()))
+                else:
+                    cur.execute(self.sql.generate_release_savepoint_stmt("sample_row"))
+        return failures
+
+    def stream(self, select_statement, params=None, fetch_size=2000, primary=False):
+        """
+        Yield the result in lists of at most fetch_size rows from a named
+        (server-side) cursor, so memory stays flat however large the result.
+        Served by a replica unless primary is set.
+        """
+        replica = None if primary else self._read_replica()
+        if replica is not None:
+            streaming = False
+            try:
+                for rows in self._stream(replica, select_statement, params, fetch_size):
+                    streaming = True
+                    yield rows
+                return
+            except Exception as error:
+                # the consumer already has part of the result, a retry would duplicate it
+                if streaming:
+                    raise
+                self._replica_failed(replica, error)
+        yield from self._stream(None, select_statement, params, fetch_size)
+
+    def _stream(self, replica, select_statement, params, fetch_size):
+        with self.connection(replica) as conn:
+            cur = conn.cursor(name="stream_{}".format(uuid.uuid4().hex))
+            spent = 0.0
+            streamed = 0
+            failed = False
+            try:
+                started = time.perf_counter()
+                cur.execute(select_statement, params)
+                while True:
+                    rows = cur.fetchmany(fetch_size)
+                    spent += time.perf_counter() - started
+                    if not rows:
+                        break
+                    streamed += len(rows)
+                    yield rows
+                    started = time.perf_counter()
+            except Exception:
+                failed = True
+                raise
+            finally:
+                # only time spent in the database, not waiting on the consumer
+                query_stats.record(select_statement, spent, streamed, failed)
+                # read-only: ending the transaction also drops the cursor
+                if not conn.closed:
+                    cur.close()
+                    conn.rollback()
+
+    def read(self, select_statement, params=None, primary=False):
+        """Rows of select_statement, from a replica unless primary is set; None on error."""
+        replica = None if primary else self._read_replica()
+        if replica is not None:
+            try:
+                with self.cursor(replica) as cur:
+                    self.run(cur, select_statement, params)
+                    return cur.fetchall()
+            except Exception as error:
+                self._replica_failed(replica, error)
         records = None
         try:
-            cur = self.conn.cursor()
-            cur.execute(select_statement)
-            records = cur.fetchall()
+            with self.cursor() as cur:
+                self.run(cur, select_statement, params)
+                records = cur.fetchall()
         except Exception as error:
-            print(f"Error: '{error}'")
-            self.conn.rollback()
+            self.logger.error(f"Error reading: '{error}'")
             records = None
-        finally:
-            if cur:
-                cur.close()
-            return records
-            
+        return records
 
     @staticmethod
     def cleanup(database):
-        sql = Sql()
-        logger = logging.getLogger("Database")
-        try:
-            cleanup_statement = sql.generate_solarpanel_cleanup_stmt()
-            database.execute(cleanup_statement)
-            cleanup_statement = sql.generate_zoe_cleanup_stmt()
-            database.execute(cleanup_statement)
-            cleanup_statement = sql.generate_e320_cleanup_stmt()
-            database.execute(cleanup_statement)
-            cleanup_statement = sql.generate_phone_calls_cleanup_stmt()
-            database.execute(cleanup_statement)
-            cleanup_statement = sql.generate_phone_calls_cleanup_stmt()
-            database.execute(cleanup_statement)
-        except Exception as error:
-            logger.error(f"Error: '{error}'")
+        # Retention is enforced by dropping whole daily partitions.
+        Partitions.maintain(database)
 
     @staticmethod
     def initialize_tables(database):
         sql = Sql()
         logger = logging.getLogger("Database")
+        if not database.is_available():
+            logger.warning("Database tables not initialized - no database connection")
+            return False
+        def execute(statement):
+            # unlike Database.execute this raises, a failed statement must
+            # leave the tables uninitialized so the next call tries again
+            with database.cursor() as cur:
+                database.run(cur, statement)
+
         try:
+            for resolution in sql.ROLLUP_RESOLUTIONS:
+                execute(sql.generate_rollup_table_stmt(resolution))
+            execute(sql.generate_rollup_watermarks_table_stmt())
+
             table_statement = sql.generate_solarpanel_table_stmt()
-            database.execute(table_statement)
+            Partitions.initialize(database, "solarpanels", table_statement)
             index_statement = sql.generate_solarpanel_index_stmt()
-            database.execute(index_statement)
-            
+            execute(index_statement)
+            execute(sql.generate_drop_index_stmt("solarpanels_index"))
+
             table_statement = sql.generate_zoe_table_stmt()
-            database.execute(table_statement)
+            Partitions.initialize(database, "zoe", table_statement)
             index_statement = sql.generate_zoe_index_stmt()
-            database.execute(index_statement)
-            
+            execute(index_statement)
+            execute(sql.generate_drop_index_stmt("zoe_index"))
+
             table_statement = sql.generate_e320_table_stmt()
-            database.execute(table_statement)
+            Partitions.initialize(database, "e320", table_statement)
+            execute(sql.generate_e320_aggregate_columns_stmt())
             index_statement = sql.generate_e320_index_stmt()
-            database.execute(index_statement)
-            
+            execute(index_statement)
+            execute(sql.generate_drop_index_stmt("e320_index"))
+
             table_statement = sql.generate_phone_calls_table_stmt()
-            database.execute(table_statement)
+            Partitions.initialize(database, "phone_calls", table_statement)
             index_statement = sql.generate_phone_calls_index_stmt()
-            database.execute(index_statement)
-            
+            execute(index_statement)
+            execute(sql.generate_phone_calls_nullable_call_id_stmt())
+            execute(sql.generate_phone_calls_unique_index_stmt())
+            execute(sql.generate_drop_index_stmt("phone_calls_index"))
+
+            table_statement = sql.generate_devices_table_stmt()
+            Partitions.initialize(database, "devices", table_statement)
+            execute(sql.generate_devices_index_stmt())
+
+            database.initialized = True
             logger.info("Database tables initialized successfully")
         except Exception as error:
-            logger.error(f"Error initializing tables: '{error}'")
\ No newline at end of file
+            logger.error(f"Error initializing tables: '{error}'")
+        return database.initialized
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of the points to keep, always including the first
+    and the last point.
+    """
+    length = len(xs)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+
+    kept = [0]
+    every = (length - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third triangle corner
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, length)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax = xs[a]
+        ay = ys[a]
+        best = start
+        best_area = -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        kept.append(best)
+        a = best
+    kept.append(length - 1)
+    return kept
+
+
+def delta_encode(values):
+    """First value absolute, every following value as the difference to its predecessor."""
+    encoded = []
+    previous = 0
+    for value in values:
+        encoded.append(value - previous)
+        previous = value
+    return encoded
+
+
+def bucket_average(times, values, width):
+    """Average time-ordered points into fixed-width buckets (times and width in seconds)."""
+    buckets = []
+    sums = []
+    counts = []
+    for timestamp, value in zip(times, values):
+        bucket = timestamp // width * width
+        if buckets and buckets[-1] == bucket:
+            sums[-1] += value
+            counts[-1] += 1
+        else:
+            buckets.append(bucket)
+            sums.append(value)
+            counts.append(1)
+    return buckets, [total / count for total, count in zip(sums, counts)]
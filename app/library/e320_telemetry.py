@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime as dt
+
+from library.Configuration import Configuration
+from library.latest_values import latest_values
+from library.samples import E320Sample
+from library.timerange import LOCAL_TZ
+
+
+class MinuteAggregate():
+    """min/max/avg/last of the power readings within one minute."""
+
+    __slots__ = ("minute", "e_in", "e_out", "last", "min", "max", "sum", "count")
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.e_in = None
+        self.e_out = None
+        self.last = None
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, e_in, e_out, power):
+        self.e_in = e_in
+        self.e_out = e_out
+        self.last = power
+        self.min = power if self.min is None else min(self.min, power)
+        self.max = power if self.max is None else max(self.max, power)
+        self.sum += power
+        self.count += 1
+
+    def sample(self):
+        return E320Sample(
+            self.minute, self.e_in, self.e_out, self.last,
+            self.min, self.max, round(self.sum / self.count, 3), self.count,
+        )
+
+
+class E320Telemetry():
+    """
+    Subscribes to the Tasmota SENSOR telemetry of the E320 reader and folds
+    every reading into per-minute aggregates. The readings arrive at the
+    device's TelePeriod on paho's network thread; the E320 job drains the
+    finished minutes into the write buffer. While the telemetry is missing
+    the job polls the device over HTTP and adds those readings here too, so
+    every minute is stored once whichever way its readings came in.
+    """
+
+    # a day of minutes in case nobody drains
+    MAX_FINISHED = 1440
+
+    def __init__(self):
+        self.config = Configuration()
+        self.logger = logging.getLogger("E320Telemetry")
+        self.topic = self.config.e320_mqtt_topic()
+        self.max_age = self.config.e320_mqtt_max_age()
+        self._lock = threading.Lock()
+        self._current = None
+        self._finished = deque(maxlen=self.MAX_FINISHED)
+        self._last_message = None
+        self._client = None
+
+    def start(self):
+        # paho-mqtt is only needed when the telemetry is switched on
+        import paho.mqtt.client as mqtt
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="home-e320")
+        if self.config.mqtt_user():
+            client.username_pw_set(self.config.mqtt_user(), self.config.mqtt_pass())
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        # connects and reconnects on paho's own thread
+        client.connect_async(self.config.mqtt_host(), self.config.mqtt_port(), keepalive=60)
+        client.loop_start()
+        self._client = client
+
+    def stop(self):
+        if self._client is not None:
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            self.logger.warning(f"MQTT broker refused the connection: '{reason_code}'")
+            return
+        # subscribe on every connect, a clean session forgets subscriptions
+        client.subscribe(self.topic)
+        self.logger.info(f"Subscribed to {self.topic}")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.logger.warning(f"MQTT connection lost: '{reason_code}'")
+
+    def _on_message(self, client, userdata, message):
+        try:
+            self.handle(message.payload)
+        except Exception as error:
+            self.logger.warning(f"Ignoring E320 telemetry {message.payload[:200]!r}: '{error}'")
+
+    def handle(self, payload, now=None):
+        """Fold one SENSOR message ({"Time": ..., "E320": {"E_in": ..., "E_out": ..., "Power": ...}}) in."""
+        reading = json.loads(payload)["E320"]
+        self.add(reading["E_in"], reading["E_out"], reading["Power"], now)
+        with self._lock:
+            self._last_message = time.monotonic()
+
+    def add(self, e_in, e_out, power, now=None):
+        """Fold one reading into the aggregate of its minute."""
+        e_in = float(e_in)
+        e_out = float(e_out)
+        power = float(power)
+        # the device clock is naive local time, the receive time is good enough
+        now = now or dt.now(LOCAL_TZ)
+        minute = now.replace(second=0, microsecond=0)
+        with self._lock:
+            if self._current is not None and self._current.minute != minute:
+                self._finished.append(self._current.sample())
+                self._current = None
+            if self._current is None:
+                self._current = MinuteAggregate(minute)
+            self._current.add(e_in, e_out, power)
+        latest_values.update(E320Sample(now, e_in, e_out, power))
+
+    def is_fresh(self):
+        with self._lock:
+            return self._last_message is not None and time.monotonic() - self._last_message <= self.max_age
+
+    def drain(self, now=None, include_current=False):
+        """Aggregates of all finished minutes, oldest first; include_current on shutdown."""
+        minute = (now or dt.now(LOCAL_TZ)).replace(second=0, microsecond=0)
+        with self._lock:
+            # close the running minute once it is over, even if no reading followed
+            if self._current is not None and (include_current or self._current.minute < minute):
+                self._finished.append(self._current.sample())
+                self._current = None
+            finished = list(self._finished)
+            self._finished.clear()
+        return finished
+
+
+e320_telemetry = E320Telemetry()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+import requests
+from fritzconnection import FritzConnection
+from fritzconnection.core.exceptions import FritzAuthorizationError, FritzSecurityError
+from library.Configuration import Configuration
+
+
+class FritzSession():
+    """
+    One long-lived FritzConnection shared by every Fritzbox caller. The
+    router's TR-064 descriptions are parsed once and cached on disk, and
+    its HTTP keep-alive pool is reused between polls. The connection is
+    rebuilt when the router rejects the session or drops the connection.
+    """
+
+    RECONNECT_ERRORS = (
+        FritzAuthorizationError,
+        FritzSecurityError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+    )
+
+    def __init__(self):
+        self.config = Configuration()
+        self.logger = logging.getLogger("FritzSession")
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def connection(self):
+        with self._lock:
+            if self._connection is None:
+                self._connection = FritzConnection(
+                    address=self.config.fritz_api_ip() or "192.168.178.1",
+                    user=self.config.fritz_api_user() or "",
+                    password=self.config.fritz_api_pass() or "",
+                    timeout=self.config.fritz_timeout(),
+                    use_cache=True,
+                    cache_directory=self.config.fritz_cache_directory(),
+                )
+                self.logger.info("Connected to the Fritzbox")
+            return self._connection
+
+    def reset(self, connection=None):
+        with self._lock:
+            # another thread may already have replaced the broken connection
+            if connection is None or self._connection is connection:
+                self._connection = None
+
+    def call(self, func):
+        """Run func(connection), reconnecting once on session or connection errors."""
+        connection = self.connection()
+        try:
+            return func(connection)
+        except self.RECONNECT_ERRORS as error:
+            self.logger.warning(f"Fritzbox session lost, reconnecting: '{error}'")
+            self.reset(connection)
+            return func(self.connection())
+
+    def call_action(self, service_name, action_name, **kwargs):
+        return self.call(lambda connection: connection.call_action(service_name, action_name, **kwargs))
+
+
+fritz_session = FritzSession()
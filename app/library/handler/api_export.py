@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import logging
+import threading
+from datetime import datetime as dt
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from library.Configuration import Configuration
+from library.sql import Sql
+from library.timerange import LOCAL_TZ, localize
+
+
+# Without a replica each running export holds a primary connection until
+# the download ends, so only a few may run next to the collector jobs.
+export_slots = threading.BoundedSemaphore(Configuration().export_max_concurrent())
+
+
+class ExportSlot():
+    """One taken export slot, given back once however the download ends."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = True
+
+    def release(self):
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        export_slots.release()
+
+
+class ApiExport:
+    MEDIA_TYPES = {
+        "csv": "text/csv",
+        "ndjson": "application/x-ndjson",
+        "arrow": "application/vnd.apache.arrow.stream",
+    }
+
+    def __init__(self, database):
+        self.logger = logging.getLogger("API_EXPORT")
+        self.config = Configuration()
+        self.database = database
+        self.sql = Sql()
+
+    def _batches(self, table, start, end):
+        return self.database.stream(
+            self.sql.generate_export_query(table), (start, end), self.config.export_fetch_size()
+        )
+
+    def csv_chunks(self, table, columns, start, end):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in self._batches(table, start, end):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def ndjson_chunks(self, table, columns, start, end):
+        for rows in self._batches(table, start, end):
+            yield "".join(
+                json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+            )
+
+    def arrow_chunks(self, table, columns, start, end):
+        import pyarrow as pa
+
+        types = {
+            "timestamp": pa.timestamp("us", tz=LOCAL_TZ.zone),
+            "float": pa.float64(),
+            "integer": pa.int64(),
+            "text": pa.string(),
+        }
+        column_types = self.sql.EXPORT_TABLES[table][1]
+        schema = pa.schema([(column, types[column_types[column]]) for column in columns])
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        for rows in self._batches(table, start, end):
+            values = list(zip(*rows))
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(v, type=field.type) for v, field in zip(values, schema)],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
+
+    def _releasing(self, chunks, slot):
+        # the slot is held until the download ends or the client goes away
+        try:
+            yield from chunks
+        finally:
+            chunks.close()
+            slot.release()
+
+    @staticmethod
+    def _finish(chunks, slot):
+        # runs after the response, also when the client left before the first
+        # chunk and the generator never started
+        chunks.close()
+        slot.release()
+
+    def get(self, table, fmt="csv", start=None, end=None):
+        if table not in self.sql.EXPORT_TABLES:
+            return JSONResponse(status_code=404, content={"error": f"Unknown table '{table}'"})
+        if fmt not in self.MEDIA_TYPES:
+            return JSONResponse(status_code=400, content={"error": f"Unknown format '{fmt}'"})
+        if fmt == "arrow":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                return JSONResponse(status_code=400, content={"error": "Arrow export needs pyarrow installed"})
+
+        start = localize(start) if start else dt.fromtimestamp(0, LOCAL_TZ)
+        end = localize(end) if end else dt.now(LOCAL_TZ)
+        columns = tuple(self.sql.EXPORT_TABLES[table][1])
+        if not export_slots.acquire(blocking=False):
+            return JSONResponse(status_code=429, content={"error": "Too many exports running, try again later"})
+        slot = ExportSlot()
+        self.logger.info(f"... exporting {table} as {fmt} from {start} to {end}")
+        chunks = self._releasing(getattr(self, f"{fmt}_chunks")(table, columns, start, end), slot)
+        return StreamingResponse(
+            chunks,
+            media_type=self.MEDIA_TYPES[fmt],
+            headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'},
+            background=BackgroundTask(self._finish, chunks, slot),
+        )
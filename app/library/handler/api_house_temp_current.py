@@ -15,4 +15,4 @@ class ApiHouseTempCurrent(RequestHandler):
 
     def get(self):
         solar_production = self.database.read(self.sql.generate_solarpanel_last_entry_query())
-        self.write({'temperature_outside': solar_production[0][0]})
+        self.write({'temperature_outside': solar_production[0][1]})
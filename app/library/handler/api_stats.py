@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+from fastapi.responses import JSONResponse
+from library.ring_buffer import rings
+from library.sql import Sql
+from library.timerange import today_bounds
+
+
+class ApiStats:
+    def __init__(self, database):
+        self.logger = logging.getLogger("API_STATS")
+        self.database = database
+        self.sql = Sql()
+
+    async def get(self, metric):
+        """Today's min/max/avg/last of a metric, from memory whenever the ring covers today."""
+        metrics = self.sql.generate_timeseries_metrics()
+        if metric not in metrics:
+            return JSONResponse(status_code=404, content={"error": f"Unknown metric '{metric}'"})
+
+        start, end = today_bounds()
+        if rings.covers(metric, start):
+            _, values = rings.between(metric, start, end)
+            if not values:
+                return {"metric": metric, "count": 0}
+            return {
+                "metric": metric,
+                "min": min(values),
+                "max": max(values),
+                "avg": round(sum(values) / len(values), 3),
+                "last": values[-1],
+                "count": len(values),
+            }
+
+        source, column = metrics[metric]
+        rows = await self.database.read(self.sql.generate_raw_stats_query(source, column), (start, end))
+        if rows is None:
+            self.logger.error(f"Error fetching stats for {metric}")
+            return JSONResponse(status_code=500, content={"error": "Failed to fetch stats"})
+        minimum, maximum, average, last, count = rows[0]
+        if not count:
+            return {"metric": metric, "count": 0}
+        return {
+            "metric": metric,
+            "min": minimum,
+            "max": maximum,
+            "avg": round(average, 3),
+            "last": last,
+            "count": count,
+        }
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime as dt, timedelta
+from fastapi.responses import JSONResponse
+from library.downsampling import bucket_average, delta_encode, lttb
+from library.ring_buffer import rings
+from library.sql import Sql
+from library.timerange import LOCAL_TZ, localize
+
+
+class ApiTimeseries:
+    # raw rows are kept for at least a day (whole partitions), hourly rollups are fine up to two months
+    RAW_WINDOW = timedelta(hours=25)
+    HOURLY_WINDOW = timedelta(days=62)
+    NATIVE_WIDTH = {"raw": 60, "hourly": 3600, "daily": 86400}
+    MAX_POINTS = 5000
+
+    def __init__(self, database):
+        self.logger = logging.getLogger("API_TIMESERIES")
+        self.database = database
+        self.sql = Sql()
+
+    def resolution(self, start, end):
+        now = dt.now(LOCAL_TZ)
+        if start >= now - self.RAW_WINDOW:
+            return "raw"
+        if end - start <= self.HOURLY_WINDOW:
+            return "hourly"
+        return "daily"
+
+    def query(self, resolution, source, column, start, end, width):
+        params = {"start": start, "end": end, "width": width}
+        if resolution == "raw":
+            return self.sql.generate_raw_bucket_query(source, column), params
+        params["source"] = source
+        params["metric"] = column
+        return self.sql.generate_rollup_bucket_query(resolution), params
+
+    async def get(self, metric, start=None, end=None, points=500):
+        metrics = self.sql.generate_timeseries_metrics()
+        if metric not in metrics:
+            return JSONResponse(status_code=404, content={"error": f"Unknown metric '{metric}'"})
+
+        end = localize(end) if end else dt.now(LOCAL_TZ)
+        start = localize(start) if start else end - timedelta(days=1)
+        if start >= end:
+            return JSONResponse(status_code=400, content={"error": "'from' must be before 'to'"})
+        points = max(3, min(points, self.MAX_POINTS))
+
+        source, column = metrics[metric]
+        resolution = self.resolution(start, end)
+        # pre-bucket in SQL to a few candidates per output point, LTTB picks the rest
+        span = (end - start).total_seconds()
+        width = max(self.NATIVE_WIDTH[resolution], int(span / (points * 4)))
+
+        if resolution == "raw" and rings.covers(metric, start):
+            times, values = rings.between(metric, start, end)
+            buckets, ys = bucket_average(times, values, width)
+            xs = [int(bucket * 1000) for bucket in buckets]
+            resolution = "memory"
+        else:
+            statement, params = self.query(resolution, source, column, start, end, width)
+            rows = await self.database.read(statement, params)
+            if rows is None:
+                self.logger.error(f"Error fetching time series for {metric}")
+                return JSONResponse(status_code=500, content={"error": "Failed to fetch time series"})
+            xs = [int(bucket.timestamp() * 1000) for bucket, _ in rows]
+            ys = [value for _, value in rows]
+
+        kept = lttb(xs, ys, points)
+        return {
+            "metric": metric,
+            "resolution": resolution,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "count": len(kept),
+            # epoch milliseconds: first value absolute, then deltas
+            "t": delta_encode([xs[i] for i in kept]),
+            "v": [round(ys[i], 3) for i in kept],
+        }
@@ -21,7 +21,7 @@ class ApiZoeBattery(RequestHandler):
             result = self.database.read(self.sql.generate_zoe_last_entry_query())
             
             if result:
-                battery_level, total_mileage = result[0]
+                _, battery_level, total_mileage = result[0]
                 
                 zoe_data = {
                     "battery_level": battery_level,
@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import aiohttp
+
+
+class HttpSession():
+    """
+    One aiohttp ClientSession shared by the collector coroutines, so polls
+    reuse pooled keep-alive connections. Opened on first use because it has
+    to be created inside the running event loop.
+    """
+
+    def __init__(self):
+        self._session = None
+
+    def get(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=120),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_session = HttpSession()
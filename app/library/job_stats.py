@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from datetime import datetime as dt
+
+from library.query_stats import tagged
+from library.timerange import LOCAL_TZ
+
+
+class JobRecord():
+
+    __slots__ = (
+        "runs", "successes", "failures", "timeouts", "skipped", "total", "max",
+        "last_duration", "last_success", "last_failure", "last_error",
+    )
+
+    def __init__(self):
+        self.runs = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last_duration = None
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+
+    def describe(self):
+        return {
+            "runs": self.runs,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "avg_seconds": round(self.total / self.runs, 6) if self.runs else 0.0,
+            "max_seconds": round(self.max, 6),
+            "last_seconds": round(self.last_duration, 6) if self.last_duration is not None else None,
+            "last_success": self.last_success.isoformat() if self.last_success else None,
+            "last_failure": self.last_failure.isoformat() if self.last_failure else None,
+            "last_error": self.last_error,
+        }
+
+
+class JobStats():
+    """Runtime, outcome counts and last success per scheduler job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def record(self, name, duration, outcome, error=None):
+        """outcome is "success", "failure" or "timeout"."""
+        now = dt.now(LOCAL_TZ)
+        with self._lock:
+            job = self._jobs.setdefault(name, JobRecord())
+            job.runs += 1
+            job.total += duration
+            job.max = max(job.max, duration)
+            job.last_duration = duration
+            if outcome == "success":
+                job.successes += 1
+                job.last_success = now
+            else:
+                if outcome == "timeout":
+                    job.timeouts += 1
+                else:
+                    job.failures += 1
+                job.last_failure = now
+                job.last_error = error
+
+    def skip(self, name):
+        with self._lock:
+            self._jobs.setdefault(name, JobRecord()).skipped += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: job.describe() for name, job in self._jobs.items()}
+
+
+job_stats = JobStats()
+
+
+def monitored(name, func, timeout, none_is_failure=False):
+    """
+    Wrap a scheduler job: time it, enforce timeout, count the outcome in
+    job_stats and attribute its queries to "job:<name>". Blocking functions
+    run on a worker thread; a thread that outlives its timeout cannot be
+    killed, so later runs are skipped until it has finished. Collectors
+    that swallow their errors pass none_is_failure to count a None result.
+    """
+    logger = logging.getLogger("JobStats")
+    func = tagged("job:{}".format(name), func)
+    is_coroutine = inspect.iscoroutinefunction(func)
+    running = []
+    abandoned = set()
+
+    def log_abandoned(done):
+        # awaited runs report their error below; a run that outlived its
+        # timeout can only report it to the log
+        if done not in abandoned:
+            return
+        abandoned.discard(done)
+        if not done.cancelled() and done.exception() is not None:
+            logger.error(f"Abandoned run of job {name} failed: '{done.exception()}'")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if running and not running[0].done():
+            logger.warning(f"Skipping {name}, the previous run is still busy")
+            job_stats.skip(name)
+            return None
+        started = time.monotonic()
+        task = None
+        try:
+            if is_coroutine:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            else:
+                task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+                task.add_done_callback(log_abandoned)
+                running[:] = [task]
+                result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if task is not None:
+                abandoned.add(task)
+            job_stats.record(name, time.monotonic() - started, "timeout", f"timed out after {timeout}s")
+            logger.error(f"Job {name} timed out after {timeout}s")
+            return None
+        except Exception as error:
+            job_stats.record(name, time.monotonic() - started, "failure", str(error))
+            logger.error(f"Job {name} failed: '{error}'")
+            return None
+        if none_is_failure and result is None:
+            job_stats.record(name, time.monotonic() - started, "failure", "no result")
+        else:
+            job_stats.record(name, time.monotonic() - started, "success")
+        return result
+
+    return wrapper
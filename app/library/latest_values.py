@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+from datetime import datetime as dt
+
+
+class LatestValues():
+    """
+    Process-wide store of the newest sample per table. The collector jobs
+    update it on every successful sample so the "current" endpoints can
+    answer without a database round trip.
+    """
+
+    # seconds after which a value counts as stale, until the collector's
+    # polling policy reports its interval through expect()
+    MAX_AGE = {
+        "solarpanels": 180,
+        "e320": 180,
+        "zoe": 1800,
+    }
+    # on top of two intervals, for the run itself and a late scheduler
+    GRACE_SECONDS = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._max_age = dict(self.MAX_AGE)
+
+    def expect(self, table, seconds):
+        """The collector of table now delivers a sample every seconds at most."""
+        with self._lock:
+            self._max_age[table] = 2 * seconds + self.GRACE_SECONDS
+
+    def max_age(self, table):
+        with self._lock:
+            return self._max_age.get(table, 300)
+
+    def update(self, sample):
+        with self._lock:
+            current = self._samples.get(sample.table)
+            if current is None or sample.timestamp >= current.timestamp:
+                self._samples[sample.table] = sample
+
+    def get(self, table):
+        with self._lock:
+            return self._samples.get(table)
+
+    def describe(self, sample):
+        """Sample fields plus staleness metadata, ready to be returned as JSON."""
+        age = (dt.now().astimezone() - sample.timestamp).total_seconds()
+        values = sample._asdict()
+        values["timestamp"] = sample.timestamp.isoformat()
+        values["age_seconds"] = round(age, 1)
+        values["stale"] = age > self.max_age(sample.table)
+        return values
+
+
+latest_values = LatestValues()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime as dt, timedelta
+
+from library.Configuration import Configuration
+from library.sql import Sql
+from library.timerange import LOCAL_TZ, day_bounds
+
+
+class Partitions():
+    """Daily range partitions (local days) for the time-series tables."""
+
+    DAYS_AHEAD = 7
+
+    @staticmethod
+    def partition_name(table, day):
+        return "{}_p{:%Y%m%d}".format(table, day)
+
+    @staticmethod
+    def create(cur, table, first_day, last_day):
+        sql = Sql()
+        day = first_day
+        while day <= last_day:
+            cur.execute(
+                sql.generate_partition_stmt(table, Partitions.partition_name(table, day)),
+                day_bounds(day),
+            )
+            day += timedelta(days=1)
+
+    @staticmethod
+    def first_day(table, today):
+        """Oldest day still within the table's retention; collectors may backfill that far."""
+        return today - timedelta(days=Sql.PARTITIONED_TABLES[table])
+
+    @staticmethod
+    def initialize(database, table, table_statement):
+        """Create the partitioned table, migrating a plain legacy table in place."""
+        sql = Sql()
+        logger = logging.getLogger("Partitions")
+        today = dt.now(LOCAL_TZ).date()
+        with database.cursor() as cur:
+            cur.execute(sql.generate_relkind_query(), (table,))
+            row = cur.fetchone()
+            if row and row[0] == "r":
+                legacy = "{}_legacy".format(table)
+                cur.execute(sql.generate_rename_table_stmt(table, legacy))
+                cur.execute(sql.generate_rename_index_stmt("{}_pkey".format(table), "{}_pkey".format(legacy)))
+                cur.execute(sql.generate_rename_index_stmt("{}_index".format(table), "{}_index".format(legacy)))
+                cur.execute(table_statement)
+                cur.execute(sql.generate_table_range_query(legacy))
+                oldest, max_id = cur.fetchone()
+                first_day = oldest.astimezone(LOCAL_TZ).date() if oldest else today
+                first_day = min(first_day, Partitions.first_day(table, today))
+                Partitions.create(cur, table, first_day, today + timedelta(days=Partitions.DAYS_AHEAD))
+                cur.execute(sql.generate_copy_rows_stmt(legacy, table))
+                if max_id:
+                    cur.execute(sql.generate_sequence_sync_stmt(table), (max_id,))
+                cur.execute(sql.generate_drop_table_stmt(legacy))
+                logger.info(f"Migrated {table} to daily partitions")
+            else:
+                cur.execute(table_statement)
+                Partitions.create(cur, table, Partitions.first_day(table, today), today + timedelta(days=Partitions.DAYS_AHEAD))
+
+    @staticmethod
+    def maintain(database):
+        """Create upcoming partitions and drop the ones past their table's retention."""
+        sql = Sql()
+        logger = logging.getLogger("Partitions")
+        today = dt.now(LOCAL_TZ).date()
+        now = dt.now(LOCAL_TZ)
+        for table, retention_days in sql.PARTITIONED_TABLES.items():
+            try:
+                with database.cursor() as cur:
+                    Partitions.create(cur, table, Partitions.first_day(table, today), today + timedelta(days=Partitions.DAYS_AHEAD))
+
+                    watermark = None
+                    if table in sql.ROLLUP_SOURCES:
+                        cur.execute(sql.generate_rollup_watermark_query(), (table,))
+                        row = cur.fetchone()
+                        # rows behind the watermark are rolled up again for a while
+                        watermark = (row[0] if row else 0) - Configuration().rollup_rescan_ids()
+
+                    cur.execute(sql.generate_partitions_query(), (table,))
+                    for (partition,) in cur.fetchall():
+                        try:
+                            day = dt.strptime(partition.rsplit("_p", 1)[1], "%Y%m%d").date()
+                        except (IndexError, ValueError):
+                            continue
+                        if day_bounds(day)[1] > now - timedelta(days=retention_days):
+                            continue
+                        if watermark is not None:
+                            # keep raw rows until the rollup job has folded them in
+                            cur.execute(sql.generate_partition_max_id_query(partition))
+                            max_id = cur.fetchone()[0]
+                            if max_id is not None and max_id > watermark:
+                                continue
+                        cur.execute(sql.generate_detach_partition_stmt(table, partition))
+                        cur.execute(sql.generate_drop_table_stmt(partition))
+                        logger.info(f"Dropped partition {partition}")
+            except Exception as error:
+                logger.error(f"Error maintaining partitions of {table}: '{error}'")
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from datetime import datetime as dt, timedelta
+
+from library.handler.api_weather import ApiWeather
+from library.latest_values import latest_values
+from library.timerange import LOCAL_TZ
+
+
+class Daylight():
+    """Today's sunrise and sunset from the weather forecast, refreshed once a day."""
+
+    # poll normally a little before sunrise and after sunset
+    MARGIN = timedelta(minutes=30)
+    RETRY_SECONDS = 3600
+
+    def __init__(self):
+        self.logger = logging.getLogger("Daylight")
+        self._day = None
+        self._sun = None
+        self._retry_at = 0.0
+
+    def refresh(self):
+        """Blocking: fetch the forecast unless today's times are known."""
+        today = dt.now(LOCAL_TZ).date()
+        if self._day == today or time.monotonic() < self._retry_at:
+            return
+        forecast = ApiWeather().fetch()
+        # fetch() returns the error message instead of a list on failure
+        if isinstance(forecast, list):
+            for day in forecast:
+                sunrise = dt.fromtimestamp(day["sunrise"] / 1000, LOCAL_TZ)
+                if sunrise.date() == today:
+                    self._sun = (sunrise, dt.fromtimestamp(day["sunset"] / 1000, LOCAL_TZ))
+                    self._day = today
+                    self.logger.info(f"Daylight from {self._sun[0]:%H:%M} to {self._sun[1]:%H:%M}")
+                    return
+        self.logger.warning(f"No sunrise/sunset for {today}, polling as if it were day")
+        self._sun = None
+        self._retry_at = time.monotonic() + self.RETRY_SECONDS
+
+    def is_daylight(self, now=None):
+        if self._sun is None:
+            return True
+        now = now or dt.now(LOCAL_TZ)
+        sunrise, sunset = self._sun
+        return sunrise - self.MARGIN <= now <= sunset + self.MARGIN
+
+
+class PollingPolicy():
+    """Fixed interval that backs off exponentially on consecutive errors."""
+
+    def __init__(self, seconds, max_seconds):
+        self.seconds = seconds
+        self.max_seconds = max_seconds
+        self.failures = 0
+
+    def prepare(self):
+        """Blocking preparation before the interval is picked, run in a thread."""
+
+    def base_interval(self):
+        return self.seconds
+
+    def next_interval(self, succeeded):
+        self.failures = 0 if succeeded else self.failures + 1
+        interval = self.base_interval()
+        if self.failures:
+            interval = max(interval, min(interval * 2 ** self.failures, self.max_seconds))
+        return interval
+
+
+class SolarPolicy(PollingPolicy):
+    """The garage solar socket only needs a slow heartbeat at night."""
+
+    def __init__(self, daylight, seconds=60, night_seconds=900, max_seconds=1800):
+        super().__init__(seconds, max_seconds)
+        self.daylight = daylight
+        self.night_seconds = night_seconds
+
+    def prepare(self):
+        self.daylight.refresh()
+
+    def base_interval(self):
+        return self.seconds if self.daylight.is_daylight() else self.night_seconds
+
+
+class ZoePolicy(PollingPolicy):
+    """Follow a charge closely, check a parked car rarely."""
+
+    INTERVALS = {"charging": 300, "plugged": 900, "parked": 1800}
+
+    def __init__(self, state, max_seconds=7200):
+        super().__init__(self.INTERVALS["plugged"], max_seconds)
+        # callable returning the last known state, one of INTERVALS
+        self.state = state
+
+    def base_interval(self):
+        return self.INTERVALS.get(self.state(), self.seconds)
+
+
+class AdaptiveJob():
+    """
+    Runs a collector coroutine and moves its scheduler job to the interval
+    the policy picks. The collector returns its sample, or None on failure.
+    With table set, the latest values of that table count as stale only
+    once the current interval has passed twice.
+    """
+
+    def __init__(self, scheduler, job_id, policy, func, *args, table=None):
+        self.logger = logging.getLogger("AdaptiveJob")
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.policy = policy
+        self.func = func
+        self.args = args
+        self.table = table
+        self.seconds = policy.seconds
+        self.jitter = None
+
+    def add(self, jitter=None, **kwargs):
+        self.jitter = jitter
+        self.scheduler.add_job(
+            self.run, "interval", id=self.job_id, seconds=self.seconds, jitter=jitter, **kwargs
+        )
+        self._expect(self.seconds)
+
+    def _expect(self, seconds):
+        if self.table is not None:
+            latest_values.expect(self.table, seconds + (self.jitter or 0))
+
+    async def run(self):
+        result = await self.func(*self.args)
+        try:
+            await asyncio.to_thread(self.policy.prepare)
+        except Exception as error:
+            self.logger.warning(f"Could not prepare the polling policy of {self.job_id}: '{error}'")
+        seconds = self.policy.next_interval(result is not None)
+        # the back-off after errors does not stretch it, failing values are stale
+        self._expect(self.policy.base_interval())
+        if seconds != self.seconds:
+            self.logger.info(f"Polling {self.job_id} every {seconds}s")
+            self.scheduler.reschedule_job(self.job_id, trigger="interval", seconds=seconds, jitter=self.jitter)
+            self.seconds = seconds
+        return result
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import functools
+import inspect
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from library.Configuration import Configuration
+
+
+# Who issued the query: the HTTP path or the scheduler job.
+query_source = ContextVar("query_source", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PARTITION_SUFFIX = re.compile(r"_p\d{8}\b")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+_VALUES_LIST = re.compile(r"\bVALUES\s*\(.*?\)(?:\s*,\s*\(.*?\))+", re.IGNORECASE | re.DOTALL)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement):
+    """Statement text with literals and row lists folded, used as the stats key."""
+    if isinstance(statement, bytes):
+        statement = statement.decode("utf-8", "replace")
+    text = _STRING_LITERAL.sub("?", statement)
+    text = _PARTITION_SUFFIX.sub("_p?", text)
+    text = _NUMBER.sub("?", text)
+    text = _VALUES_LIST.sub("VALUES (...)", text)
+    text = _WHITESPACE.sub(" ", text).strip().rstrip(";")
+    return text[:QueryStats.MAX_KEY_LENGTH]
+
+
+class StatementStats():
+
+    __slots__ = ("calls", "errors", "rows", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(QueryStats.BUCKETS) + 1)
+
+    def add(self, duration, rows, failed):
+        self.calls += 1
+        self.errors += 1 if failed else 0
+        self.rows += max(rows, 0)
+        self.total += duration
+        self.max = max(self.max, duration)
+        for index, bound in enumerate(QueryStats.BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def describe(self):
+        histogram = {}
+        cumulative = 0
+        for bound, count in zip(QueryStats.BUCKETS + ("+Inf",), self.buckets):
+            cumulative += count
+            histogram[str(bound)] = cumulative
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_seconds": round(self.total, 6),
+            "avg_seconds": round(self.total / self.calls, 6) if self.calls else 0.0,
+            "max_seconds": round(self.max, 6),
+            "histogram": histogram,
+        }
+
+
+class QueryStats():
+    """
+    Latency histograms per normalized statement and per source, plus the
+    most recent slow queries. Fed by TimedCursor, so every statement that
+    goes through the pool is counted.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    MAX_KEY_LENGTH = 200
+    MAX_STATEMENTS = 500
+    SLOW_LOG_SIZE = 50
+
+    def __init__(self):
+        self.config = Configuration()
+        self.logger = logging.getLogger("QueryStats")
+        self.slow_threshold = self.config.postgres_slow_query_seconds()
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._sources = {}
+        self._slow = deque(maxlen=self.SLOW_LOG_SIZE)
+
+    def record(self, statement, duration, rows=0, failed=False):
+        key = normalize(statement)
+        source = query_source.get() or "other"
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= self.MAX_STATEMENTS:
+                    key = "(other statements)"
+                stats = self._statements.setdefault(key, StatementStats())
+            stats.add(duration, rows, failed)
+            self._sources.setdefault(source, StatementStats()).add(duration, rows, failed)
+            if duration >= self.slow_threshold:
+                self._slow.append({
+                    "statement": key,
+                    "source": source,
+                    "seconds": round(duration, 6),
+                    "rows": rows,
+                    "at": time.time(),
+                })
+        if duration >= self.slow_threshold:
+            self.logger.warning(f"Slow query ({duration:.3f}s, {rows} rows, {source}): {key}")
+
+    def snapshot(self):
+        with self._lock:
+            statements = {key: stats.describe() for key, stats in self._statements.items()}
+            sources = {key: stats.describe() for key, stats in self._sources.items()}
+            slow = list(self._slow)
+        ranked = sorted(statements.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return {
+            "slow_threshold_seconds": self.slow_threshold,
+            "statements": dict(ranked),
+            "sources": sources,
+            "slow_queries": slow,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._sources.clear()
+            self._slow.clear()
+
+
+def tagged(source, func):
+    """Wrap a scheduler job so the queries it issues are attributed to source."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def coroutine_wrapper(*args, **kwargs):
+            token = query_source.set(source)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                query_source.reset(token)
+        return coroutine_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = query_source.set(source)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            query_source.reset(token)
+    return wrapper
+
+
+query_stats = QueryStats()
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import html
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import requests
+
+from library.Configuration import Configuration
+
+
+SEARCH_URL = "https://www.dastelefonbuch.de/Rueckwaerts-Suche"
+
+# Compiled once; tried in order on the result page.
+NAME_PATTERNS = [
+    # Name in result entry
+    re.compile(r'<div[^>]*class="name"[^>]*>([^<]+)</div>', re.IGNORECASE),
+    # Name in h2 or h3 tags
+    re.compile(r'<h[23][^>]*class="[^"]*name[^"]*"[^>]*>([^<]+)</h[23]>', re.IGNORECASE),
+    # Name in data-name attribute
+    re.compile(r'data-name="([^"]+)"', re.IGNORECASE),
+    # Name in contact info section
+    re.compile(r'<div[^>]*class="contact[^"]*"[^>]*>.*?<span[^>]*class="name"[^>]*>([^<]+)</span>', re.IGNORECASE | re.DOTALL),
+    # General name extraction from result items
+    re.compile(r'<div[^>]*class="result[^"]*"[^>]*>.*?([A-Z][a-zA-Z]+\s+[A-Z][a-zA-Z]+).*?</div>', re.IGNORECASE | re.DOTALL),
+    # Names in result list items
+    re.compile(r'<li[^>]*class="result[^"]*"[^>]*>.*?<span[^>]*>([^<]+)</span>', re.IGNORECASE | re.DOTALL),
+    # Names in address entries
+    re.compile(r'<div[^>]*class="address[^"]*"[^>]*>.*?<span[^>]*>([^<]+)</span>', re.IGNORECASE | re.DOTALL),
+]
+TITLE_PATTERN = re.compile(r"<title>([^<]+)</title>", re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_number(number):
+    """Digits only, international German numbers in national form (0049.../+49... -> 0...)."""
+    number = (number or "").strip()
+    if number.startswith("+"):
+        number = "00" + number[1:]
+    digits = NON_DIGITS.sub("", number)
+    if digits.startswith("0049"):
+        digits = "0" + digits[4:]
+    return digits
+
+
+def extract_name(page):
+    for pattern in NAME_PATTERNS:
+        match = pattern.search(page)
+        if match:
+            name = TAG_PATTERN.sub("", html.unescape(match.group(1).strip()))[:50].strip()
+            # Ensure we have a meaningful name
+            if len(name) > 2:
+                return name
+    title = TITLE_PATTERN.search(page)
+    if title:
+        title = title.group(1)
+        if len(title) > 5 and "Telefonbuch" not in title:
+            return html.unescape(title.strip())[:30]
+    return None
+
+
+class TokenBucket():
+    """Allows rate requests per second with bursts up to capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hand out no tokens for seconds, e.g. after the server answered 429."""
+        with self._lock:
+            self._tokens = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, timeout):
+        """Blocking: take a token, False if none becomes available within timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    start = max(self._updated, self._paused_until)
+                    self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LookupCache():
+    """SQLite cache of reverse lookups; misses are stored as NULL names."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lookups ("
+                "number TEXT PRIMARY KEY, "
+                "name TEXT, "
+                "fetched_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, number, hit_ttl, miss_ttl):
+        """(True, name) for a fresh entry (name None for a remembered miss), else (False, None)."""
+        with self._lock, closing(self._connect()) as conn:
+            row = conn.execute("SELECT name, fetched_at FROM lookups WHERE number = ?", (number,)).fetchone()
+        if row is None:
+            return False, None
+        name, fetched_at = row
+        ttl = hit_ttl if name else miss_ttl
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, name
+
+    def put(self, number, name):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO lookups (number, name, fetched_at) VALUES (?, ?, ?)",
+                (number, name, time.time()),
+            )
+
+
+class ReverseLookup():
+    """
+    Reverse phone number lookup on dastelefonbuch.de. Answers, including
+    "not found", are cached per normalized number, and requests go through
+    a token bucket so the site does not start answering 429.
+    """
+
+    def __init__(self, url=SEARCH_URL, cache_path=None):
+        self.config = Configuration()
+        self.logger = logging.getLogger("ReverseLookup")
+        self.url = url
+        self.cache_path = cache_path
+        self.hit_ttl = self.config.reverse_lookup_hit_ttl_days() * 86400
+        self.miss_ttl = self.config.reverse_lookup_miss_ttl_hours() * 3600
+        self.bucket = TokenBucket(self.config.reverse_lookup_rate_per_minute() / 60.0, capacity=3)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+            "Accept-Language": "de-DE,de;q=0.9,en;q=0.8",
+        })
+        self._cache = None
+        self._cache_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # opened on first use so importing the module touches no files
+        with self._cache_lock:
+            if self._cache is None:
+                self._cache = LookupCache(self.cache_path or self.config.reverse_lookup_cache_path())
+            return self._cache
+
+    def lookup(self, phonenumber, timeout=30):
+        """
+        Blocking: name for phonenumber, "" if the site knows no name, None if
+        the lookup could not be done (rate limit, errors) and should be
+        retried later. Waits at most timeout for the rate limit.
+        """
+        number = normalize_number(phonenumber)
+        if not number:
+            return None
+        cached, name = self.cache.get(number, self.hit_ttl, self.miss_ttl)
+        if cached:
+            return name or ""
+        if not self.bucket.acquire(timeout):
+            # not cached, so a later call looks it up again
+            self.logger.info(f"Rate limit reached, skipping lookup of {number}")
+            return None
+        try:
+            response = self.session.post(
+                self.url,
+                data={"phone": number, "stype": "RBP", "mode": "search"},
+                timeout=10,
+            )
+        except requests.RequestException as error:
+            self.logger.warning(f"Reverse lookup of {number} failed: '{error}'")
+            return None
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            self.bucket.pause(int(retry_after) if retry_after.isdigit() else 300)
+            self.logger.warning("Reverse lookup rate limited by the server")
+            return None
+        if response.status_code == 404:
+            name = None
+        elif response.status_code != 200:
+            self.logger.warning(f"Reverse lookup of {number} answered {response.status_code}")
+            return None
+        else:
+            name = extract_name(response.text)
+        self.cache.put(number, name)
+        return name or ""
+
+
+reverse_lookup = ReverseLookup()
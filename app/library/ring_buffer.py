@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from array import array
+from datetime import datetime as dt, timedelta
+
+from library.samples import SAMPLE_TYPES
+from library.sql import Sql
+from library.timerange import LOCAL_TZ
+
+
+class MetricRing():
+    """Fixed-size ring of (epoch seconds, value) pairs kept in two float arrays."""
+
+    __slots__ = ("capacity", "_times", "_values", "_next", "_size")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._size = 0
+
+    def append(self, timestamp, value):
+        self._times[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def covers(self, start):
+        # once the ring has wrapped, anything older than its oldest slot is gone
+        if self._size < self.capacity:
+            return True
+        return self._times[self._next] <= start
+
+    def between(self, start, end):
+        """Points with start <= t < end in time order."""
+        times = []
+        values = []
+        first = (self._next - self._size) % self.capacity
+        for offset in range(self._size):
+            index = (first + offset) % self.capacity
+            timestamp = self._times[index]
+            if start <= timestamp < end:
+                times.append(timestamp)
+                values.append(self._values[index])
+        return times, values
+
+
+class RingStore():
+    """
+    Per-metric rings holding the last 24 hours of samples ("e320.power", ...).
+    Filled by the collector jobs and pre-loaded from Postgres at startup so
+    "today" charts and stats need no SQL.
+    """
+
+    WINDOW = timedelta(hours=24)
+    CAPACITY = 1440
+
+    def __init__(self):
+        self.logger = logging.getLogger("RingStore")
+        self.sql = Sql()
+        self._lock = threading.Lock()
+        self._rings = {
+            metric: MetricRing(self.CAPACITY)
+            for metric in self.sql.generate_timeseries_metrics()
+        }
+        self._covered_since = None
+
+    def record(self, sample):
+        timestamp = sample.timestamp.timestamp()
+        with self._lock:
+            for column in self.sql.ROLLUP_SOURCES.get(sample.table, ()):
+                average = self.sql.METRIC_AVERAGES.get((sample.table, column))
+                value = getattr(sample, average) if average else None
+                if value is None:
+                    value = getattr(sample, column)
+                self._rings["{}.{}".format(sample.table, column)].append(timestamp, float(value))
+
+    def covers(self, metric, start):
+        """True if the ring of metric holds every sample since start."""
+        start = start.timestamp()
+        with self._lock:
+            if self._covered_since is None or start < self._covered_since:
+                return False
+            return self._rings[metric].covers(start)
+
+    def between(self, metric, start, end):
+        with self._lock:
+            return self._rings[metric].between(start.timestamp(), end.timestamp())
+
+    def preload(self, database):
+        since = dt.now(LOCAL_TZ) - self.WINDOW
+        try:
+            for sample_type in SAMPLE_TYPES.values():
+                if sample_type.table not in self.sql.ROLLUP_SOURCES:
+                    continue
+                statement = self.sql.generate_samples_since_query(sample_type.table, sample_type._fields)
+                with database.cursor() as cur:
+                    cur.execute(statement, (since,))
+                    rows = cur.fetchall()
+                for row in rows:
+                    self.record(sample_type(*row))
+            with self._lock:
+                self._covered_since = since.timestamp()
+            self.logger.info("Ring buffers pre-loaded from the database")
+        except Exception as error:
+            # only samples collected from now on are served from memory
+            self.logger.warning(f"Could not pre-load ring buffers: '{error}'")
+            with self._lock:
+                self._covered_since = dt.now(LOCAL_TZ).timestamp()
+
+
+rings = RingStore()
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+from library.Configuration import Configuration
+from library.sql import Sql
+
+
+class Rollup():
+
+    @staticmethod
+    def run(database):
+        """
+        Fold raw rows newer than each source's watermark into the hourly and
+        daily rollups. The last ROLLUP_RESCAN_IDS ids behind the watermark are
+        looked at again, for rows that committed after higher ids.
+        """
+        sql = Sql()
+        logger = logging.getLogger("Rollup")
+        rescan = Configuration().rollup_rescan_ids()
+        for source in sql.ROLLUP_SOURCES:
+            try:
+                # One transaction per source: the watermark only moves if the
+                # rollups for that id range were written.
+                with database.cursor() as cur:
+                    params = {"source": source}
+                    cur.execute(sql.generate_rollup_watermark_init_stmt(), params)
+                    cur.execute(sql.generate_rollup_watermark_lock_query(), params)
+                    params["from_id"] = cur.fetchone()[0]
+                    params["rescan_id"] = max(params["from_id"] - rescan, 0)
+                    cur.execute(sql.generate_rollup_delta_query(source), params)
+                    to_id, since = cur.fetchone()
+                    if to_id is None:
+                        continue
+                    params["to_id"] = to_id
+                    params["since"] = since
+                    cur.execute(sql.generate_rollup_hourly_stmt(source), params)
+                    cur.execute(sql.generate_rollup_daily_stmt(), params)
+                    cur.execute(sql.generate_rollup_watermark_update_stmt(), params)
+                logger.info(f"Rolled up {source} rows {params['rescan_id'] + 1}..{to_id}")
+            except Exception as error:
+                logger.error(f"Error rolling up {source}: '{error}'")
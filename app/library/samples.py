@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Typed rows the collector jobs hand to the WriteBuffer.
+Field order matches the column order of the target table.
+"""
+
+import json
+from datetime import datetime as dt
+from typing import NamedTuple
+
+
+class SolarpanelSample(NamedTuple):
+    timestamp: dt
+    temperature: float
+    status: int
+    power: float
+
+    table = "solarpanels"
+
+
+class E320Sample(NamedTuple):
+    timestamp: dt
+    e_in: float
+    e_out: float
+    power: float
+    # per-minute aggregates of the telemetry and HTTP readings
+    power_min: float = None
+    power_max: float = None
+    power_avg: float = None
+    samples: int = None
+
+    table = "e320"
+
+
+class ZoeSample(NamedTuple):
+    timestamp: dt
+    battery_level: float
+    total_mileage: float
+
+    table = "zoe"
+
+
+class DeviceSample(NamedTuple):
+    timestamp: dt
+    ain: str
+    name: str
+    present: int
+    power: float
+    energy: float
+    temperature: float
+
+    table = "devices"
+
+
+# class name -> sample type, used to restore spooled samples
+SAMPLE_TYPES = {
+    sample_type.__name__: sample_type
+    for sample_type in (SolarpanelSample, E320Sample, ZoeSample, DeviceSample)
+}
+
+
+def sample_to_json(sample):
+    values = sample._asdict()
+    values["timestamp"] = sample.timestamp.isoformat()
+    return json.dumps(values)
+
+
+def sample_from_json(type_name, payload):
+    values = json.loads(payload)
+    values["timestamp"] = dt.fromisoformat(values["timestamp"])
+    return SAMPLE_TYPES[type_name](**values)
@@ -1,13 +1,16 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from jobs.homeAutomation import HomeAutomation
 
 from jobs.zoe import Zoe
 from jobs.e320 import E320
 from jobs.phone import Phone
+from library.async_database import AsyncDatabase
 from library.database import Database
+from library.rollup import Rollup
+from library.write_buffer import WriteBuffer
 from library.Configuration import Configuration
 
 
@@ -15,7 +18,9 @@ class Scheduler:
     def __init__(self, database):
         self.config = Configuration()
         self.database = database
-        self.scheduler = BackgroundScheduler({"apscheduler.timezone": "Europe/Berlin"})
+        self.write_buffer = WriteBuffer(database)
+        # collectors are coroutines, tornado's IOLoop runs on asyncio
+        self.scheduler = AsyncIOScheduler({"apscheduler.timezone": "Europe/Berlin"})
         self.register_jobs()
 
     def start(self):
@@ -23,15 +28,19 @@ class Scheduler:
 
     def register_jobs(self):
         if self.config.scheduler_active():
-            Phone.fetch(self.database)
+            async_database = AsyncDatabase(self.database)
+            # no trigger: run once right away
+            self.scheduler.add_job(Phone.fetch, args=[async_database])
             self.scheduler.add_job(
-                HomeAutomation.fetch, "interval", [self.database], minutes=1
+                HomeAutomation.fetch, "interval", [self.write_buffer], minutes=1
             )
-            self.scheduler.add_job(E320.fetch, "interval", [self.database], minutes=1)
-            self.scheduler.add_job(Zoe.fetch, "interval", [self.database], minutes=15)
-            self.scheduler.add_job(Phone.fetch, "interval", [self.database], minutes=15)
+            self.scheduler.add_job(E320.fetch, "interval", [self.write_buffer], minutes=1)
+            self.scheduler.add_job(Zoe.fetch, "interval", [self.write_buffer], minutes=15)
+            self.scheduler.add_job(Phone.fetch, "interval", [async_database], minutes=15)
+            self.scheduler.add_job(Rollup.run, "interval", [self.database], minutes=15)
             self.scheduler.add_job(
                 Database.cleanup, "cron", [self.database], hour="10", minute="30"
             )
+            self.scheduler.add_job(self.write_buffer.flush_if_due, "interval", seconds=15)
         else:
             pass
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from psycopg2.extras import execute_values
+
+from library.Configuration import Configuration
+from library.database import CONNECTION_ERRORS, Database
+from library.samples import sample_from_json, sample_to_json
+from library.sql import Sql
+
+
+class Spool():
+    """
+    Append-only SQLite file that keeps samples while Postgres is unreachable.
+    Rows are removed only after they were replayed into Postgres, or moved
+    to the quarantine table when Postgres rejects them for good.
+    """
+
+    def __init__(self, path=None):
+        self.config = Configuration()
+        self.logger = logging.getLogger("Spool")
+        self.path = path or self.config.spool_path()
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "sample_type TEXT NOT NULL, "
+                "payload TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quarantine ("
+                "id INTEGER PRIMARY KEY, "
+                "sample_type TEXT NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "error TEXT NOT NULL, "
+                "quarantined_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, samples):
+        rows = [(type(sample).__name__, sample_to_json(sample)) for sample in samples]
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT INTO spool (sample_type, payload) VALUES (?, ?)", rows)
+        self.logger.warning(f"Spooled {len(rows)} samples while the database is unavailable")
+
+    def pending(self):
+        with self._lock, closing(self._connect()) as conn:
+            return conn.execute("SELECT count(*) FROM spool").fetchone()[0]
+
+    def quarantined(self):
+        with self._lock, closing(self._connect()) as conn:
+            return conn.execute("SELECT count(*) FROM quarantine").fetchone()[0]
+
+    def read_batch(self, limit):
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, sample_type, payload FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        batch = []
+        broken = []
+        for row_id, sample_type, payload in rows:
+            try:
+                batch.append((row_id, sample_from_json(sample_type, payload)))
+            except Exception as error:
+                broken.append((row_id, "cannot decode: {}".format(error)))
+        if broken:
+            self.quarantine(broken)
+        return batch
+
+    def quarantine(self, failures):
+        """Move (row id, error) spool rows aside so they no longer block the replay."""
+        now = time.time()
+        with self._lock, closing(self._connect()) as conn, conn:
+            for row_id, error in failures:
+                self._move_to_quarantine(conn, row_id, error, now)
+        for row_id, error in failures:
+            self.logger.error(f"Quarantined spooled sample {row_id}: '{error}'")
+
+    def quarantine_samples(self, failures):
+        """Quarantine (sample, error) pairs that were never spooled, e.g. from the write buffer."""
+        now = time.time()
+        with self._lock, closing(self._connect()) as conn, conn:
+            for sample, error in failures:
+                # through the spool, so the id cannot clash with a spooled row's
+                row_id = conn.execute(
+                    "INSERT INTO spool (sample_type, payload) VALUES (?, ?)",
+                    (type(sample).__name__, sample_to_json(sample)),
+                ).lastrowid
+                self._move_to_quarantine(conn, row_id, error, now)
+        for sample, error in failures:
+            self.logger.error(f"Quarantined {sample.table} sample of {sample.timestamp}: '{error}'")
+
+    @staticmethod
+    def _move_to_quarantine(conn, row_id, error, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO quarantine (id, sample_type, payload, error, quarantined_at) "
+            "SELECT id, sample_type, payload, ?, ? FROM spool WHERE id = ?",
+            (error, now, row_id),
+        )
+        conn.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+
+    def delete_through(self, last_id):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+
+
+class SpoolReplayer():
+
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def run(database, spool):
+        """Bulk-load spooled samples once the database is reachable again."""
+        logger = logging.getLogger("SpoolReplayer")
+        if not database.initialized and not Database.initialize_tables(database):
+            return
+        replayed = 0
+        try:
+            while True:
+                batch = spool.read_batch(SpoolReplayer.BATCH_SIZE)
+                if not batch:
+                    break
+                try:
+                    SpoolReplayer._insert(database, batch)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as error:
+                    # e.g. the partition of old samples is already dropped;
+                    # find the rows Postgres rejects and set them aside
+                    logger.warning(f"Replaying {len(batch)} spooled samples failed, retrying one by one: '{str(error).strip()}'")
+                    failures = SpoolReplayer._insert_each(database, batch)
+                    spool.quarantine(failures)
+                    replayed -= len(failures)
+                spool.delete_through(batch[-1][0])
+                replayed += len(batch)
+        except CONNECTION_ERRORS as error:
+            logger.warning(f"Database still unavailable, {spool.pending()} samples remain spooled: '{error}'")
+        except Exception as error:
+            logger.error(f"Error replaying spooled samples: '{error}'")
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled samples")
+
+    @staticmethod
+    def _insert(database, batch):
+        sql = Sql()
+        by_type = {}
+        for _, sample in batch:
+            by_type.setdefault(type(sample), []).append(sample)
+        with database.cursor() as cur:
+            for sample_type, samples in by_type.items():
+                statement = sql.generate_bulk_insert_stmt(sample_type.table, sample_type._fields)
+                execute_values(cur, statement, samples, page_size=500)
+
+    @staticmethod
+    def _insert_each(database, batch):
+        """Insert row by row, returning (row id, error) of the rejected ones."""
+        failures = database.insert_each([sample for _, sample in batch])
+        return [(batch[index][0], error) for index, error in failures]
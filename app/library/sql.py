@@ -1,76 +1,405 @@
 from datetime import datetime as dt
 
+from library.timerange import today_bounds
+
+
+class Statement():
+    """A registered, server-side prepared statement plus the parameters for one execution."""
+
+    def __init__(self, name, params=()):
+        self.name = name
+        self.params = tuple(params)
+
+    def execute_stmt(self):
+        if not self.params:
+            return 'EXECUTE {};'.format(self.name)
+        return 'EXECUTE {} ({});'.format(self.name, ", ".join(["%s"] * len(self.params)))
+
+    def __repr__(self):
+        return 'Statement({!r}, {!r})'.format(self.name, self.params)
+
+
 class Sql():
 
+    # name -> (parameter types, statement text); prepared once per pooled connection
+    PREPARED_STATEMENTS = {
+        "solarpanel_insert": (
+            ("timestamptz", "float8", "int4", "float8"),
+            'INSERT INTO "solarpanels" ("timestamp","temperature","status","power") VALUES ($1, $2, $3, $4)',
+        ),
+        "zoe_insert": (
+            ("timestamptz", "float8", "float8"),
+            'INSERT INTO "zoe" ("timestamp","battery_level","total_mileage") VALUES ($1, $2, $3)',
+        ),
+        "e320_insert": (
+            ("timestamptz", "float8", "float8", "float8"),
+            'INSERT INTO "e320" ("timestamp","e_in","e_out","power") VALUES ($1, $2, $3, $4)',
+        ),
+        "phone_calls_insert": (
+            ("timestamptz", "int4", "varchar", "varchar", "varchar", "varchar"),
+            'INSERT INTO "phone_calls" ("timestamp","call_id","caller_number","caller_name","call_date","call_duration") VALUES ($1, $2, $3, $4, $5, $6)',
+        ),
+        # *_last_entry columns follow the field order of the library.samples types
+        "solarpanel_last_entry": (
+            (),
+            'SELECT "timestamp", temperature, status, power FROM solarpanels ORDER BY "timestamp" DESC LIMIT 1',
+        ),
+        "zoe_last_entry": (
+            (),
+            'SELECT "timestamp", battery_level, total_mileage FROM zoe ORDER BY "timestamp" DESC LIMIT 1',
+        ),
+        "e320_last_entry": (
+            (),
+            'SELECT "timestamp", e_in, e_out, power FROM e320 ORDER BY "timestamp" DESC LIMIT 1',
+        ),
+        "phone_calls_last_entry": (
+            (),
+            'SELECT caller_number, caller_name, call_date, call_duration FROM phone_calls ORDER BY "timestamp" DESC LIMIT 1',
+        ),
+        "phone_calls_last_call_id": (
+            (),
+            'SELECT max(call_id) FROM phone_calls',
+        ),
+        "solarpanel_range": (
+            ("timestamptz", "timestamptz"),
+            'SELECT temperature, "timestamp", power FROM solarpanels WHERE "timestamp" >= $1 AND "timestamp" < $2 ORDER BY "timestamp" ASC',
+        ),
+        "e320_range": (
+            ("timestamptz", "timestamptz"),
+            'SELECT "timestamp", e_in, e_out, power FROM e320 WHERE "timestamp" >= $1 AND "timestamp" < $2 ORDER BY "timestamp" ASC',
+        ),
+        "phone_calls_range": (
+            ("timestamptz", "timestamptz"),
+            'SELECT "timestamp", caller_number, caller_name, call_date, call_duration FROM phone_calls WHERE "timestamp" >= $1 AND "timestamp" < $2 ORDER BY "timestamp" ASC',
+        ),
+        "phone_calls_unmatched": (
+            ("timestamptz",),
+            'SELECT "id", "timestamp", caller_number, caller_name FROM phone_calls WHERE call_id IS NULL AND "timestamp" >= $1',
+        ),
+        "phone_calls_unnamed_numbers": (
+            ("timestamptz", "int4"),
+            'SELECT DISTINCT caller_number FROM phone_calls WHERE caller_name IS NULL AND caller_number <> \'\' AND "timestamp" >= $1 LIMIT $2',
+        ),
+        "phone_calls_known_ids": (
+            ("int4[]",),
+            'SELECT call_id FROM phone_calls WHERE call_id = ANY($1)',
+        ),
+    }
+
+    # raw table -> metric columns maintained in the hourly and daily rollups
+    ROLLUP_SOURCES = {
+        "solarpanels": ("temperature", "power"),
+        "e320": ("e_in", "e_out", "power"),
+        "zoe": ("battery_level", "total_mileage"),
+    }
+
+    # (table, metric column) -> column with the minute average, used when set;
+    # the E320 telemetry rows keep the last reading in "power"
+    METRIC_AVERAGES = {
+        ("e320", "power"): "power_avg",
+    }
+
+    ROLLUP_RESOLUTIONS = ("hourly", "daily")
+
+    # daily range-partitioned table -> retention in days
+    PARTITIONED_TABLES = {
+        "solarpanels": 1,
+        "e320": 1,
+        "zoe": 1,
+        "phone_calls": 7,
+        "devices": 7,
+    }
+
+    # exportable table -> (time column, exported column -> type); the types fix
+    # the Arrow schema up front, NULLs in the first rows say nothing about them
+    EXPORT_TABLES = {
+        "solarpanels": ("timestamp", {"timestamp": "timestamp", "temperature": "float", "status": "integer", "power": "float"}),
+        "e320": ("timestamp", {"timestamp": "timestamp", "e_in": "float", "e_out": "float", "power": "float", "power_min": "float", "power_max": "float", "power_avg": "float", "samples": "integer"}),
+        "zoe": ("timestamp", {"timestamp": "timestamp", "battery_level": "float", "total_mileage": "float"}),
+        "phone_calls": ("timestamp", {"timestamp": "timestamp", "call_id": "integer", "caller_number": "text", "caller_name": "text", "call_date": "text", "call_duration": "text"}),
+        "devices": ("timestamp", {"timestamp": "timestamp", "ain": "text", "name": "text", "present": "integer", "power": "float", "energy": "float", "temperature": "float"}),
+        "rollup_hourly": ("bucket", {"source": "text", "metric": "text", "bucket": "timestamp", "min": "float", "max": "float", "sum": "float", "count": "integer", "last": "float", "last_timestamp": "timestamp"}),
+        "rollup_daily": ("bucket", {"source": "text", "metric": "text", "bucket": "timestamp", "min": "float", "max": "float", "sum": "float", "count": "integer", "last": "float", "last_timestamp": "timestamp"}),
+    }
+
+    def generate_prepare_stmt(self, name):
+        types, text = self.PREPARED_STATEMENTS[name]
+        if not types:
+            return 'PREPARE {} AS {};'.format(name, text)
+        return 'PREPARE {} ({}) AS {};'.format(name, ", ".join(types), text)
+
+    def generate_deallocate_stmt(self, name):
+        return 'DEALLOCATE {};'.format(name)
+
+    def generate_savepoint_stmt(self, name):
+        return 'SAVEPOINT {};'.format(name)
+
+    def generate_rollback_to_savepoint_stmt(self, name):
+        return 'ROLLBACK TO SAVEPOINT {};'.format(name)
+
+    def generate_release_savepoint_stmt(self, name):
+        return 'RELEASE SAVEPOINT {};'.format(name)
+
+    def generate_bulk_insert_stmt(self, table, columns):
+        return 'INSERT INTO "{}" ({}) VALUES %s;'.format(table, ",".join('"{}"'.format(c) for c in columns))
+
     def generate_solarpanel_insert_stmt(self, temp, status, power):
-        insert_stmt = 'INSERT INTO "solarpanels" ("timestamp","temperature","status","power") VALUES (\'{}\', {}, {}, {});'
-        return insert_stmt.format(dt.now(), temp, status, power)
+        return Statement("solarpanel_insert", (dt.now().astimezone(), temp, status, power))
 
     def generate_zoe_insert_stmt(self, battery_level, total_mileage):
-        insert_stmt = 'INSERT INTO "zoe" ("timestamp","battery_level","total_mileage") VALUES (\'{}\', {}, {});'
-        return insert_stmt.format(dt.now(), battery_level, total_mileage)
+        return Statement("zoe_insert", (dt.now().astimezone(), battery_level, total_mileage))
 
     def generate_solarpanel_index_stmt(self):
-        return 'CREATE INDEX IF NOT EXISTS solarpanels_index ON solarpanels (timestamp);'
+        return 'CREATE INDEX IF NOT EXISTS solarpanels_timestamp_covering ON solarpanels ("timestamp") INCLUDE ("temperature","status","power");'
 
     def generate_zoe_index_stmt(self):
-        return 'CREATE INDEX IF NOT EXISTS zoe_index ON zoe (timestamp);'
+        return 'CREATE INDEX IF NOT EXISTS zoe_timestamp_covering ON zoe ("timestamp") INCLUDE ("battery_level","total_mileage");'
+
+    def generate_devices_table_stmt(self):
+        return 'CREATE TABLE IF NOT EXISTS "devices" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"ain" VARCHAR(32) NOT NULL,"name" VARCHAR(100),"present" SMALLINT NOT NULL,"power" FLOAT,"energy" FLOAT,"temperature" FLOAT,PRIMARY KEY ("id","timestamp")) PARTITION BY RANGE ("timestamp");'
+
+    def generate_devices_index_stmt(self):
+        return 'CREATE INDEX IF NOT EXISTS devices_ain_timestamp_covering ON devices ("ain","timestamp") INCLUDE ("power","energy","temperature");'
 
     def generate_zoe_table_stmt(self):
-        return 'CREATE TABLE IF NOT EXISTS "zoe" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"battery_level" FLOAT NOT NULL,"total_mileage" FLOAT NOT NULL,PRIMARY KEY ("id"));'
+        return 'CREATE TABLE IF NOT EXISTS "zoe" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"battery_level" FLOAT NOT NULL,"total_mileage" FLOAT NOT NULL,PRIMARY KEY ("id","timestamp")) PARTITION BY RANGE ("timestamp");'
 
     def generate_solarpanel_table_stmt(self):
-        return 'CREATE TABLE IF NOT EXISTS "solarpanels" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"temperature" FLOAT NOT NULL,"status" INT NOT NULL,"power" FLOAT NOT NULL,PRIMARY KEY ("id"));'
-
-    def generate_solarpanel_cleanup_stmt(self):
-        return 'DELETE FROM solarpanels WHERE timestamp < now() - interval \'1 days\';'
-    
-    def generate_zoe_cleanup_stmt(self):
-        return 'DELETE FROM zoe WHERE timestamp < now() - interval \'1 days\';'
+        return 'CREATE TABLE IF NOT EXISTS "solarpanels" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"temperature" FLOAT NOT NULL,"status" INT NOT NULL,"power" FLOAT NOT NULL,PRIMARY KEY ("id","timestamp")) PARTITION BY RANGE ("timestamp");'
 
     def generate_solarpanel_last_entry_query(self):
-        return 'SELECT temperature, power FROM solarpanels ORDER BY "timestamp" DESC LIMIT 1;'
+        return Statement("solarpanel_last_entry")
+
+    def generate_solarpanel_range_query(self, start, end):
+        return Statement("solarpanel_range", (start, end))
 
     def generate_solarpanel_all_entries_query(self):
-        return 'SELECT temperature, timestamp, power FROM solarpanels WHERE DATE(timestamp) = current_date order by timestamp ASC;'
+        return self.generate_solarpanel_range_query(*today_bounds())
 
     def generate_zoe_last_entry_query(self):
-        return 'SELECT battery_level, total_mileage FROM zoe ORDER BY "timestamp" DESC LIMIT 1;'
+        return Statement("zoe_last_entry")
 
     def generate_e320_insert_stmt(self, e_in, e_out, power):
-        insert_stmt = 'INSERT INTO "e320" ("timestamp","e_in","e_out","power") VALUES (\'{}\', {}, {}, {});'
-        return insert_stmt.format(dt.now(), e_in, e_out, power)
+        return Statement("e320_insert", (dt.now().astimezone(), e_in, e_out, power))
 
     def generate_e320_table_stmt(self):
-        return 'CREATE TABLE IF NOT EXISTS "e320" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"e_in" FLOAT NOT NULL,"e_out" FLOAT NOT NULL,"power" FLOAT NOT NULL,PRIMARY KEY ("id"));'
+        return 'CREATE TABLE IF NOT EXISTS "e320" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"e_in" FLOAT NOT NULL,"e_out" FLOAT NOT NULL,"power" FLOAT NOT NULL,"power_min" FLOAT,"power_max" FLOAT,"power_avg" FLOAT,"samples" INTEGER,PRIMARY KEY ("id","timestamp")) PARTITION BY RANGE ("timestamp");'
 
-    def generate_e320_index_stmt(self):
-        return 'CREATE INDEX IF NOT EXISTS e320_index ON e320 (timestamp);'
+    def generate_e320_aggregate_columns_stmt(self):
+        # minute aggregates of the MQTT telemetry, tables created before them lack the columns
+        return 'ALTER TABLE "e320" ADD COLUMN IF NOT EXISTS "power_min" FLOAT, ADD COLUMN IF NOT EXISTS "power_max" FLOAT, ADD COLUMN IF NOT EXISTS "power_avg" FLOAT, ADD COLUMN IF NOT EXISTS "samples" INTEGER;'
 
-    def generate_e320_cleanup_stmt(self):
-        return 'DELETE FROM e320 WHERE timestamp < now() - interval \'1 days\';'
+    def generate_e320_index_stmt(self):
+        return 'CREATE INDEX IF NOT EXISTS e320_timestamp_covering ON e320 ("timestamp") INCLUDE ("e_in","e_out","power");'
 
     def generate_e320_last_entry_query(self):
-        return 'SELECT e_in, e_out, power FROM e320 ORDER BY "timestamp" DESC LIMIT 1;'
+        return Statement("e320_last_entry")
+
+    def generate_e320_range_query(self, start, end):
+        return Statement("e320_range", (start, end))
 
     def generate_e320_all_entries_query(self):
-        return 'SELECT timestamp, e_in, e_out, power FROM e320 WHERE DATE(timestamp) = current_date order by timestamp ASC;'
+        return self.generate_e320_range_query(*today_bounds())
 
     def generate_phone_calls_insert_stmt(self, call_id, caller_number, caller_name, call_date, call_duration):
-        insert_stmt = 'INSERT INTO "phone_calls" ("timestamp","call_id","caller_number","caller_name","call_date","call_duration") VALUES (\'{}\', {}, \'{}\', \'{}\', \'{}\', \'{}\');'
-        return insert_stmt.format(dt.now(), call_id, caller_number, caller_name, call_date, call_duration)
+        return Statement(
+            "phone_calls_insert",
+            (dt.now().astimezone(), call_id, caller_number, caller_name, call_date, call_duration),
+        )
 
     def generate_phone_calls_table_stmt(self):
-        return 'CREATE TABLE IF NOT EXISTS "phone_calls" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"call_id" INTEGER NOT NULL,"caller_number" VARCHAR(50),"caller_name" VARCHAR(100),"call_date" VARCHAR(50),"call_duration" VARCHAR(20),PRIMARY KEY ("id"));'
+        return 'CREATE TABLE IF NOT EXISTS "phone_calls" ("id" BIGSERIAL NOT NULL,"timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,"call_id" INTEGER,"caller_number" VARCHAR(50),"caller_name" VARCHAR(100),"call_date" VARCHAR(50),"call_duration" VARCHAR(20),PRIMARY KEY ("id","timestamp")) PARTITION BY RANGE ("timestamp");'
 
     def generate_phone_calls_index_stmt(self):
-        return 'CREATE INDEX IF NOT EXISTS phone_calls_index ON phone_calls (timestamp);'
-
-    def generate_phone_calls_cleanup_stmt(self):
-        return 'DELETE FROM phone_calls WHERE timestamp < now() - interval \'7 days\';'
+        return 'CREATE INDEX IF NOT EXISTS phone_calls_timestamp_covering ON phone_calls ("timestamp") INCLUDE ("call_id","caller_number","caller_name","call_date","call_duration");'
 
     def generate_phone_calls_last_entry_query(self):
-        return 'SELECT caller_number, caller_name, call_date, call_duration FROM phone_calls ORDER BY "timestamp" DESC LIMIT 1;'
+        return Statement("phone_calls_last_entry")
+
+    def generate_phone_calls_last_call_id_query(self):
+        return Statement("phone_calls_last_call_id")
+
+    def generate_phone_calls_known_ids_query(self, call_ids):
+        return Statement("phone_calls_known_ids", (list(call_ids),))
+
+    def generate_phone_calls_unmatched_query(self, since):
+        return Statement("phone_calls_unmatched", (since,))
+
+    def generate_phone_calls_nullable_call_id_stmt(self):
+        # rows from the call monitor get their call_id from the next call list poll
+        return 'ALTER TABLE "phone_calls" ALTER COLUMN "call_id" DROP NOT NULL;'
+
+    def generate_phone_calls_match_stmt(self):
+        return 'UPDATE "phone_calls" AS p SET "call_id" = v.call_id, "caller_name" = v.caller_name, "call_duration" = v.call_duration FROM (VALUES %s) AS v(id, ts, call_id, caller_name, call_duration) WHERE p."id" = v.id AND p."timestamp" = v.ts;'
+
+    def generate_phone_calls_reconcile_stmt(self):
+        # monitor rows (no call_id) of a call that is also stored with its call_id,
+        # matched like Phone.match_monitored; the monitor's name fills a missing one
+        return (
+            'WITH duplicates AS ('
+            'DELETE FROM "phone_calls" AS m USING "phone_calls" AS p '
+            'WHERE m."call_id" IS NULL AND p."call_id" IS NOT NULL AND m."timestamp" >= %s '
+            'AND m."caller_number" = p."caller_number" '
+            'AND p."timestamp" BETWEEN m."timestamp" - interval \'1 minute\' AND m."timestamp" + interval \'1 minute\' '
+            'RETURNING p."id" AS id, p."timestamp" AS ts, m."caller_name" AS caller_name) '
+            'UPDATE "phone_calls" AS p SET "caller_name" = d.caller_name FROM duplicates AS d '
+            'WHERE p."id" = d.id AND p."timestamp" = d.ts AND COALESCE(p."caller_name", \'\') = \'\' AND d.caller_name <> \'\';'
+        )
+
+    def generate_phone_calls_unique_index_stmt(self):
+        # unique indexes on a partitioned table must contain the partition key,
+        # "timestamp" is the call's own date so a call always maps to one row
+        return 'CREATE UNIQUE INDEX IF NOT EXISTS phone_calls_call_id_unique ON phone_calls ("call_id","timestamp");'
+
+    def generate_phone_calls_unnamed_numbers_query(self, since, limit):
+        return Statement("phone_calls_unnamed_numbers", (since, limit))
+
+    def generate_phone_calls_names_update_stmt(self):
+        # rows whose reverse lookup was skipped or failed keep a NULL name until resolved
+        return 'UPDATE "phone_calls" AS p SET "caller_name" = v.caller_name FROM (VALUES %s) AS v(caller_number, caller_name) WHERE p."caller_number" = v.caller_number AND p."caller_name" IS NULL;'
+
+    def generate_phone_calls_bulk_insert_stmt(self):
+        return 'INSERT INTO "phone_calls" ("timestamp","call_id","caller_number","caller_name","call_date","call_duration") VALUES %s ON CONFLICT ("call_id","timestamp") DO NOTHING;'
+
+    def generate_phone_calls_range_query(self, start, end):
+        return Statement("phone_calls_range", (start, end))
 
     def generate_phone_calls_all_entries_query(self):
-        return 'SELECT timestamp, caller_number, caller_name, call_date, call_duration FROM phone_calls WHERE DATE(timestamp) = current_date order by timestamp ASC;'
\ No newline at end of file
+        return self.generate_phone_calls_range_query(*today_bounds())
+
+
+    def generate_rollup_table_stmt(self, resolution):
+        return 'CREATE TABLE IF NOT EXISTS "rollup_{}" ("source" VARCHAR(50) NOT NULL,"metric" VARCHAR(50) NOT NULL,"bucket" TIMESTAMP WITH TIME ZONE NOT NULL,"min" FLOAT NOT NULL,"max" FLOAT NOT NULL,"sum" FLOAT NOT NULL,"count" BIGINT NOT NULL,"last" FLOAT NOT NULL,"last_timestamp" TIMESTAMP WITH TIME ZONE NOT NULL,PRIMARY KEY ("source","metric","bucket"));'.format(resolution)
+
+    def generate_rollup_watermarks_table_stmt(self):
+        return 'CREATE TABLE IF NOT EXISTS "rollup_watermarks" ("source" VARCHAR(50) NOT NULL,"last_id" BIGINT NOT NULL,PRIMARY KEY ("source"));'
+
+    def generate_rollup_watermark_init_stmt(self):
+        return 'INSERT INTO "rollup_watermarks" ("source","last_id") VALUES (%(source)s, 0) ON CONFLICT ("source") DO NOTHING;'
+
+    def generate_rollup_watermark_lock_query(self):
+        return 'SELECT "last_id" FROM "rollup_watermarks" WHERE "source" = %(source)s FOR UPDATE;'
+
+    def generate_rollup_watermark_update_stmt(self):
+        return 'UPDATE "rollup_watermarks" SET "last_id" = GREATEST("last_id", %(to_id)s) WHERE "source" = %(source)s;'
+
+    def generate_rollup_delta_query(self, source):
+        return 'SELECT max("id"), min("timestamp") FROM "{}" WHERE "id" > %(rescan_id)s;'.format(source)
+
+    def generate_rollup_hourly_stmt(self, source):
+        # Ids are handed out before their transactions commit, so a row can
+        # appear behind the watermark. Every hour touched by the rescanned ids
+        # is therefore aggregated again in full and replaced, which makes
+        # rolling up the same rows twice harmless.
+        metrics = ", ".join(
+            "('{}', {})".format(metric, self.generate_metric_expression(source, metric, "r"))
+            for metric in self.ROLLUP_SOURCES[source]
+        )
+        return (
+            'INSERT INTO "rollup_hourly" ("source","metric","bucket","min","max","sum","count","last","last_timestamp") '
+            'SELECT %(source)s, m.metric, h.hour, min(m.value), max(m.value), sum(m.value), count(*), '
+            '(array_agg(m.value ORDER BY r."timestamp" DESC))[1], max(r."timestamp") '
+            'FROM (SELECT DISTINCT date_trunc(\'hour\', "timestamp") AS hour FROM "{0}" WHERE "id" > %(rescan_id)s AND "id" <= %(to_id)s) h '
+            'JOIN "{0}" r ON r."timestamp" >= h.hour AND r."timestamp" < h.hour + interval \'1 hour\' '
+            'CROSS JOIN LATERAL (VALUES {1}) AS m(metric, value) '
+            'GROUP BY m.metric, h.hour '
+            'ON CONFLICT ("source","metric","bucket") DO UPDATE SET '
+            '"min" = EXCLUDED."min", "max" = EXCLUDED."max", "sum" = EXCLUDED."sum", "count" = EXCLUDED."count", '
+            '"last" = EXCLUDED."last", "last_timestamp" = EXCLUDED."last_timestamp";'
+        ).format(source, metrics)
+
+    def generate_rollup_daily_stmt(self):
+        # Days are local (Europe/Berlin) days; the hourly buckets nest in them
+        # because the UTC offset is always a whole number of hours.
+        return (
+            'INSERT INTO "rollup_daily" ("source","metric","bucket","min","max","sum","count","last","last_timestamp") '
+            'SELECT "source", "metric", date_trunc(\'day\', "bucket" AT TIME ZONE \'Europe/Berlin\') AT TIME ZONE \'Europe/Berlin\' AS day, '
+            'min("min"), max("max"), sum("sum"), sum("count"), (array_agg("last" ORDER BY "last_timestamp" DESC))[1], max("last_timestamp") '
+            'FROM "rollup_hourly" '
+            'WHERE "source" = %(source)s AND "bucket" >= date_trunc(\'day\', %(since)s AT TIME ZONE \'Europe/Berlin\') AT TIME ZONE \'Europe/Berlin\' '
+            'GROUP BY "source", "metric", day '
+            'ON CONFLICT ("source","metric","bucket") DO UPDATE SET '
+            '"min" = EXCLUDED."min", "max" = EXCLUDED."max", "sum" = EXCLUDED."sum", "count" = EXCLUDED."count", '
+            '"last" = EXCLUDED."last", "last_timestamp" = EXCLUDED."last_timestamp";'
+        )
+
+    def generate_rollup_range_query(self, resolution):
+        return 'SELECT "bucket", "min", "max", "sum" / "count" AS "avg", "last" FROM "rollup_{}" WHERE "source" = %s AND "metric" = %s AND "bucket" >= %s AND "bucket" < %s ORDER BY "bucket" ASC;'.format(resolution)
+
+
+    def generate_drop_index_stmt(self, index):
+        return 'DROP INDEX IF EXISTS "{}";'.format(index)
+
+    def generate_relkind_query(self):
+        return 'SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = current_schema() AND c.relname = %s;'
+
+    def generate_rename_table_stmt(self, table, new_name):
+        return 'ALTER TABLE "{}" RENAME TO "{}";'.format(table, new_name)
+
+    def generate_rename_index_stmt(self, index, new_name):
+        return 'ALTER INDEX IF EXISTS "{}" RENAME TO "{}";'.format(index, new_name)
+
+    def generate_table_range_query(self, table):
+        return 'SELECT min("timestamp"), max("id") FROM "{}";'.format(table)
+
+    def generate_copy_rows_stmt(self, source, target):
+        return 'INSERT INTO "{}" SELECT * FROM "{}";'.format(target, source)
+
+    def generate_sequence_sync_stmt(self, table):
+        return 'SELECT setval(pg_get_serial_sequence(\'"{}"\', \'id\'), %s);'.format(table)
+
+    def generate_drop_table_stmt(self, table):
+        return 'DROP TABLE IF EXISTS "{}";'.format(table)
+
+    def generate_partition_stmt(self, table, partition):
+        return 'CREATE TABLE IF NOT EXISTS "{}" PARTITION OF "{}" FOR VALUES FROM (%s) TO (%s);'.format(partition, table)
+
+    def generate_partitions_query(self):
+        return 'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent JOIN pg_namespace n ON n.oid = p.relnamespace WHERE n.nspname = current_schema() AND p.relname = %s ORDER BY c.relname ASC;'
+
+    def generate_partition_max_id_query(self, partition):
+        return 'SELECT max("id") FROM "{}";'.format(partition)
+
+    def generate_rollup_watermark_query(self):
+        return 'SELECT "last_id" FROM "rollup_watermarks" WHERE "source" = %s;'
+
+    def generate_detach_partition_stmt(self, table, partition):
+        return 'ALTER TABLE "{}" DETACH PARTITION "{}";'.format(table, partition)
+
+
+    def generate_timeseries_metrics(self):
+        # public metric name ("e320.power") -> (source table, column)
+        return {
+            "{}.{}".format(source, column): (source, column)
+            for source, columns in self.ROLLUP_SOURCES.items()
+            for column in columns
+        }
+
+    def generate_metric_expression(self, source, column, alias=None):
+        prefix = '{}.'.format(alias) if alias else ''
+        average = self.METRIC_AVERAGES.get((source, column))
+        if average is None:
+            return '{}"{}"'.format(prefix, column)
+        return 'COALESCE({0}"{1}", {0}"{2}")'.format(prefix, average, column)
+
+    def generate_raw_bucket_query(self, source, column):
+        return 'SELECT to_timestamp(floor(extract(epoch FROM "timestamp") / %(width)s) * %(width)s) AS bucket, avg({}) FROM "{}" WHERE "timestamp" >= %(start)s AND "timestamp" < %(end)s GROUP BY bucket ORDER BY bucket ASC;'.format(self.generate_metric_expression(source, column), source)
+
+    def generate_rollup_bucket_query(self, resolution):
+        return 'SELECT to_timestamp(floor(extract(epoch FROM "bucket") / %(width)s) * %(width)s) AS b, sum("sum") / sum("count") FROM "rollup_{}" WHERE "source" = %(source)s AND "metric" = %(metric)s AND "bucket" >= %(start)s AND "bucket" < %(end)s GROUP BY b ORDER BY b ASC;'.format(resolution)
+
+    def generate_samples_since_query(self, table, columns):
+        return 'SELECT {} FROM "{}" WHERE "timestamp" >= %s ORDER BY "timestamp" ASC;'.format(",".join('"{}"'.format(c) for c in columns), table)
+
+    def generate_raw_stats_query(self, source, column):
+        return 'SELECT min({0}), max({0}), avg({0}), (array_agg({0} ORDER BY "timestamp" DESC))[1], count(*) FROM "{1}" WHERE "timestamp" >= %s AND "timestamp" < %s;'.format(self.generate_metric_expression(source, column), source)
+
+    def generate_export_query(self, table):
+        time_column, columns = self.EXPORT_TABLES[table]
+        return 'SELECT {} FROM "{}" WHERE "{}" >= %s AND "{}" < %s ORDER BY "{}" ASC;'.format(
+            ",".join('"{}"'.format(c) for c in columns), table, time_column, time_column, time_column
+        )
+
+    def generate_replication_lag_query(self):
+        # a standby that has replayed everything it received counts as current
+        return "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END;"
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime as dt, time, timedelta
+
+import pytz
+
+LOCAL_TZ = pytz.timezone("Europe/Berlin")
+
+
+def day_bounds(day):
+    """[start, end) of a local calendar day as timezone-aware datetimes."""
+    start = LOCAL_TZ.localize(dt.combine(day, time.min))
+    end = LOCAL_TZ.localize(dt.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def today_bounds():
+    return day_bounds(dt.now(LOCAL_TZ).date())
+
+
+def localize(value):
+    """Attach the local timezone to naive datetimes, leave aware ones alone."""
+    if value.tzinfo is None:
+        return LOCAL_TZ.localize(value)
+    return value
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from library.Configuration import Configuration
+from library.database import CONNECTION_ERRORS
+from library.query_stats import query_source
+from library.sql import Sql
+
+
+class WriteBuffer():
+    """
+    Collects samples from the scheduler jobs and writes them with one
+    multi-row INSERT per table once either the row or the age threshold
+    is reached.
+    """
+
+    def __init__(self, database, spool=None):
+        self.config = Configuration()
+        self.logger = logging.getLogger("WriteBuffer")
+        self.database = database
+        self.spool = spool
+        self.sql = Sql()
+        self.max_rows = self.config.write_buffer_max_rows()
+        self.max_age = self.config.write_buffer_max_age()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        # sample type -> query source of the job that queued it, so the
+        # inserts show up under that job whoever triggers the flush
+        self._sources = {}
+        self._count = 0
+        self._oldest = None
+
+    def add(self, sample):
+        self.add_many((sample,))
+
+    def add_many(self, samples):
+        """Queue samples of any types under one lock, flushing at most once."""
+        source = query_source.get() or "write_buffer"
+        with self._lock:
+            for sample in samples:
+                self._pending.setdefault(type(sample), []).append(sample)
+                self._sources[type(sample)] = source
+            self._count += len(samples)
+            if samples and self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._is_due()
+        if due:
+            self.flush()
+
+    def _is_due(self):
+        if self._count >= self.max_rows:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_age
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._is_due()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._count = 0
+                self._oldest = None
+
+            for sample_type, samples in pending.items():
+                statement = self.sql.generate_bulk_insert_stmt(sample_type.table, sample_type._fields)
+                with self._lock:
+                    source = self._sources.get(sample_type, "write_buffer")
+                token = query_source.set(source)
+                try:
+                    self.database.execute_values(statement, samples)
+                    self.logger.debug(f"Flushed {len(samples)} rows into {sample_type.table}")
+                except CONNECTION_ERRORS as error:
+                    self._keep(sample_type, samples, error)
+                except Exception as error:
+                    # a bad row would fail every later flush of the table, so
+                    # find the rows Postgres rejects and set them aside
+                    self.logger.warning(f"Flushing {len(samples)} rows into {sample_type.table} failed, retrying one by one: '{str(error).strip()}'")
+                    self._insert_each(sample_type, samples)
+                finally:
+                    query_source.reset(token)
+
+    def _insert_each(self, sample_type, samples):
+        try:
+            rejected = [(samples[index], error) for index, error in self.database.insert_each(samples)]
+        except CONNECTION_ERRORS as error:
+            self._keep(sample_type, samples, error)
+            return
+        except Exception as error:
+            rejected = [(sample, str(error).strip()) for sample in samples]
+        if rejected and self.spool is not None:
+            try:
+                self.spool.quarantine_samples(rejected)
+                return
+            except Exception as error:
+                self.logger.error(f"Error quarantining {len(rejected)} rows for {sample_type.table}: '{error}'")
+        for sample, error in rejected:
+            self.logger.error(f"Dropped {sample_type.table} row {sample}: '{error}'")
+
+    def _keep(self, sample_type, samples, error):
+        """Spool samples the database cannot take right now, or queue them again."""
+        if self.spool is not None and isinstance(error, CONNECTION_ERRORS):
+            self._spool(sample_type, samples)
+        else:
+            self.logger.error(f"Error flushing {len(samples)} rows into {sample_type.table}: '{error}'")
+            self._requeue(sample_type, samples)
+
+    def _spool(self, sample_type, samples):
+        try:
+            self.spool.append(samples)
+        except Exception as error:
+            self.logger.error(f"Error spooling {len(samples)} rows for {sample_type.table}: '{error}'")
+            self._requeue(sample_type, samples)
+
+    def _requeue(self, sample_type, samples):
+        with self._lock:
+            queued = self._pending.setdefault(sample_type, [])
+            queued[:0] = samples
+            limit = self.max_rows * 10
+            if len(queued) > limit:
+                self.logger.warning(f"Dropping {len(queued) - limit} buffered rows for {sample_type.table}")
+                del queued[:len(queued) - limit]
+            self._count = sum(len(rows) for rows in self._pending.values())
+            if self._oldest is None:
+                self._oldest = time.monotonic()
@@ -16,12 +16,14 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 import asyncio
 import os
 import re
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Query, Request
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -35,8 +37,18 @@ import uvicorn
 
 from library.Configuration import Configuration
 from library.database import Database
+from library.e320_telemetry import e320_telemetry
+from library.async_database import AsyncDatabase
 from library.llama_client import LlamaClient
+from library.http_session import http_session
+from library.latest_values import latest_values
+from library.job_stats import job_stats, monitored
+from library.query_stats import query_source, query_stats
+from library.ring_buffer import rings
+from library.samples import E320Sample, SolarpanelSample, ZoeSample
 from library.sql import Sql
+from library.spool import Spool, SpoolReplayer
+from library.write_buffer import WriteBuffer
 
 config = Configuration()
 logger = logging.getLogger("MAIN")
@@ -53,14 +65,20 @@ def _markdown_to_html(text: str) -> str:
     return text
 
 
-db = None
-try:
-    db = Database()
-    Database.initialize_tables(db)
-except Exception as e:
-    logger.warning(f"Database connection failed: {e}")
+# The pool connects lazily: if Postgres is down at startup the jobs still
+# run, spool their samples, and the tables are created once it is back.
+db = Database()
+async_db = AsyncDatabase(db)
+spool = Spool()
+write_buffer = WriteBuffer(db, spool)
+Database.initialize_tables(db)
+rings.preload(db)
 
-scheduler = AsyncIOScheduler(timezone="Europe/Berlin")
+# One run per job at a time; runs missed while busy collapse into one.
+scheduler = AsyncIOScheduler(
+    timezone="Europe/Berlin",
+    job_defaults={"max_instances": 1, "coalesce": True, "misfire_grace_time": 30},
+)
 llama_client = LlamaClient()
 sql = Sql()
 
@@ -74,7 +92,23 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 async def lifespan(app: FastAPI):
     scheduler.start()
     logger.info("Scheduler started")
+    call_monitor_task = None
+    if config.call_monitor_active():
+        from library.call_monitor import CallMonitor
+
+        # records calls as they end, the Phone job reconciles with the call list
+        call_monitor_task = asyncio.create_task(CallMonitor(async_db).run())
+        logger.info("Call monitor started")
+    if config.e320_mqtt_active():
+        # the E320 job stores the minute aggregates and polls only while no telemetry arrives
+        e320_telemetry.start()
+        logger.info("E320 telemetry started")
     yield
+    if call_monitor_task is not None:
+        call_monitor_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await call_monitor_task
+    e320_telemetry.stop()
     logger.info("Shutting down...")
     if telegram_app and telegram_app.updater:
         logger.info("Stopping Telegram bot...")
@@ -84,10 +118,28 @@ async def lifespan(app: FastAPI):
         logger.info("Telegram bot stopped")
     scheduler.shutdown()
     logger.info("Scheduler stopped")
+    await http_session.close()
+    # the minute in progress would be lost otherwise
+    write_buffer.add_many(e320_telemetry.drain(include_current=True))
+    write_buffer.flush()
+    logger.info("Write buffer flushed")
+    db.close()
+    logger.info("Database pool closed")
 
 
 app = FastAPI(lifespan=lifespan)
 
+
+@app.middleware("http")
+async def tag_queries(request: Request, call_next):
+    # worker threads (asyncio.to_thread) inherit the tag through the context
+    token = query_source.set("http:{}".format(request.url.path))
+    try:
+        return await call_next(request)
+    finally:
+        query_source.reset(token)
+
+
 static_path = os.path.join(BASE_DIR, "static")
 if os.path.exists(static_path):
     app.mount("/static", StaticFiles(directory=static_path), name="static")
@@ -218,18 +270,34 @@ def register_scheduler_jobs():
     from jobs.zoe import Zoe
     from jobs.e320 import E320
     from jobs.phone import Phone
+    from library.polling import AdaptiveJob, Daylight, PollingPolicy, SolarPolicy, ZoePolicy
+    from library.rollup import Rollup
 
     if config.scheduler_active():
-        if db:
-            scheduler.add_job(HomeAutomation.fetch, "interval", [db], minutes=1)
-            scheduler.add_job(E320.fetch, "interval", [db], minutes=1)
-            scheduler.add_job(Zoe.fetch, "interval", [db], minutes=15)
-            scheduler.add_job(Phone.fetch, "interval", [db], minutes=15)
-            scheduler.add_job(Database.cleanup, "cron", [db], hour=10, minute=30)
-            logger.info("Scheduler jobs registered with database")
-        else:
-            logger.warning("Scheduler jobs NOT registered - no database connection")
-
+        # the collectors are coroutines and run on the event loop itself,
+        # their intervals follow daylight, the car's state and errors;
+        # jitter spreads the jobs that share an interval over the minute
+        AdaptiveJob(
+            scheduler, "home_automation", SolarPolicy(Daylight()),
+            monitored("home_automation", HomeAutomation.fetch, timeout=30, none_is_failure=True), write_buffer,
+            table=SolarpanelSample.table,
+        ).add(jitter=10)
+        AdaptiveJob(
+            scheduler, "e320", PollingPolicy(60, 900),
+            monitored("e320", E320.fetch, timeout=20, none_is_failure=True), write_buffer,
+            table=E320Sample.table,
+        ).add(jitter=10)
+        AdaptiveJob(
+            scheduler, "zoe", ZoePolicy(lambda: Zoe.state),
+            monitored("zoe", Zoe.fetch, timeout=60, none_is_failure=True), write_buffer,
+            table=ZoeSample.table,
+        ).add(jitter=30)
+        scheduler.add_job(monitored("phone", Phone.fetch, timeout=120), "interval", [async_db], minutes=15, jitter=30, id="phone")
+        scheduler.add_job(monitored("rollup", Rollup.run, timeout=300), "interval", [db], minutes=15, jitter=30, id="rollup")
+        scheduler.add_job(monitored("cleanup", Database.cleanup, timeout=600), "cron", [db], hour=10, minute=30, id="cleanup")
+        scheduler.add_job(monitored("write_buffer", write_buffer.flush_if_due, timeout=60), "interval", seconds=15, id="write_buffer")
+        scheduler.add_job(monitored("spool_replay", SpoolReplayer.run, timeout=300), "interval", [db, spool], minutes=1, jitter=10, id="spool_replay")
+        logger.info("Scheduler jobs registered")
 
 register_scheduler_jobs()
 
@@ -291,24 +359,74 @@ async def api_openmeteo():
 
 @app.get("/api/zoe/battery/current.json")
 async def api_zoe_battery():
-    if not db:
-        return {"error": "Database not connected"}
-    handler = ApiZoeBattery(db)
+    handler = ApiZoeBattery(async_db)
     return await handler.get()
 
 
 @app.get("/api/house/temp/current.json")
 async def api_house_temp():
-    if not db:
-        return {"error": "Database not connected"}
-    handler = ApiHouseTempCurrent(db)
+    handler = ApiHouseTempCurrent(async_db)
     return await handler.get()
 
 
+@app.get("/api/timeseries/{metric}")
+async def api_timeseries(
+    metric: str,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    points: int = 500,
+):
+    from library.handler.api_timeseries import ApiTimeseries
+
+    handler = ApiTimeseries(async_db)
+    return await handler.get(metric, start, end, points)
+
+
+@app.get("/api/stats/{metric}")
+async def api_stats(metric: str):
+    from library.handler.api_stats import ApiStats
+
+    handler = ApiStats(async_db)
+    return await handler.get(metric)
+
+
+@app.get("/api/export/{table}")
+async def api_export(
+    table: str,
+    fmt: str = Query("csv", alias="format"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+):
+    from library.handler.api_export import ApiExport
+
+    # the stream runs in the threadpool with the blocking, pooled Database;
+    # it reads from a replica when there is one
+    handler = ApiExport(db)
+    return handler.get(table, fmt, start, end)
+
+
+@app.get("/api/database/pool")
+async def api_database_pool():
+    return db.pool_stats()
+
+
+@app.get("/api/metrics/jobs")
+async def api_metrics_jobs():
+    stats = job_stats.snapshot()
+    # jobs are registered with their monitored() name as id
+    for job in scheduler.get_jobs():
+        if job.id in stats:
+            stats[job.id]["next_run"] = job.next_run_time.isoformat() if job.next_run_time else None
+    return stats
+
+
+@app.get("/api/metrics/database")
+async def api_metrics_database():
+    return {"pool": db.pool_stats(), "queries": query_stats.snapshot()}
+
+
 @app.get("/api/telegram/health")
 async def api_telegram_health():
-    if not db:
-        return {"error": "Database not connected"}
     handler = ApiTelegramHealth(db)
     return await handler.get()
 
@@ -325,11 +443,15 @@ class ApiZoeBattery:
 
     async def get(self):
         try:
-            result = self.database.read(sql.generate_zoe_last_entry_query())
-            if result:
-                battery_level, total_mileage = result[0]
-                return {"battery_level": battery_level, "total_mileage": total_mileage}
-            return {"battery_level": 0, "total_mileage": 0}
+            sample = latest_values.get(ZoeSample.table)
+            if sample is None:
+                # cold start: nothing sampled since boot yet
+                result = await self.database.read(sql.generate_zoe_last_entry_query())
+                if not result:
+                    return {"battery_level": 0, "total_mileage": 0}
+                sample = ZoeSample(*result[0])
+                latest_values.update(sample)
+            return latest_values.describe(sample)
         except Exception as e:
             self.logger.error(f"Error fetching Zoe data: {e}")
             return {"error": "Failed to fetch Zoe data"}
@@ -342,11 +464,17 @@ class ApiHouseTempCurrent:
 
     async def get(self):
         try:
-            result = self.database.read(sql.generate_solarpanel_last_entry_query())
-            if result:
-                temp, status, power = result[0]
-                return {"temp": temp, "status": status, "power": power}
-            return {"temp": 0, "status": 0, "power": 0}
+            sample = latest_values.get(SolarpanelSample.table)
+            if sample is None:
+                # cold start: nothing sampled since boot yet
+                result = await self.database.read(sql.generate_solarpanel_last_entry_query())
+                if not result:
+                    return {"temp": 0, "status": 0, "power": 0}
+                sample = SolarpanelSample(*result[0])
+                latest_values.update(sample)
+            values = latest_values.describe(sample)
+            values["temp"] = values.pop("temperature")
+            return values
         except Exception as e:
             self.logger.error(f"Error fetching house temp data: {e}")
             return {"error": "Failed to fetch house temp data"}
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def database():
+    """
+    Database on the DATABASE_URL test database, tables initialized. Tests
+    that need it are skipped without DATABASE_URL; never point it at the
+    live database.
+    """
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL is not set")
+    from psycopg2.extensions import parse_dsn
+
+    dsn = parse_dsn(url)
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("POSTGRES_HOST", dsn.get("host", "localhost"))
+        env.setenv("POSTGRES_PORT", dsn.get("port", "5432"))
+        env.setenv("POSTGRES_DB", dsn.get("dbname", ""))
+        env.setenv("POSTGRES_USER", dsn.get("user", ""))
+        env.setenv("POSTGRES_PASSWORD", dsn.get("password", ""))
+
+        from library.database import Database
+
+        database = Database()
+        if not Database.initialize_tables(database):
+            database.close()
+            pytest.skip("DATABASE_URL is not reachable")
+        yield database
+        database.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+from library.handler import api_export
+from library.handler.api_export import ApiExport
+from library.timerange import LOCAL_TZ
+
+START = LOCAL_TZ.localize(dt(2026, 3, 2, 12, 0))
+
+
+class StreamingDatabase():
+    """Database stand-in that streams the given batches."""
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.closed = False
+
+    def stream(self, select_statement, params=None, fetch_size=2000, primary=False):
+        try:
+            yield from self.batches
+        finally:
+            self.closed = True
+
+
+def e320_row(minute, power_avg=None, samples=None):
+    return (START + timedelta(minutes=minute), 100.0, 20.0, 300.0, None, None, power_avg, samples)
+
+
+def free_slots():
+    taken = 0
+    while api_export.export_slots.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        api_export.export_slots.release()
+    return taken
+
+
+def test_arrow_export_keeps_types_of_columns_null_in_the_first_batch():
+    pa = pytest.importorskip("pyarrow")
+    # legacy and HTTP rows first, telemetry aggregates later
+    database = StreamingDatabase([[e320_row(0), e320_row(1)], [e320_row(2, 250.5, 6)]])
+    columns = tuple(ApiExport(database).sql.EXPORT_TABLES["e320"][1])
+
+    body = b"".join(ApiExport(database).arrow_chunks("e320", columns, START, START + timedelta(hours=1)))
+
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.schema.field("power_avg").type == pa.float64()
+    assert table.schema.field("samples").type == pa.int64()
+    assert table.column("power_avg").to_pylist() == [None, None, 250.5]
+    assert table.column("samples").to_pylist() == [None, None, 6]
+    assert table.column("timestamp").to_pylist()[2] == START + timedelta(minutes=2)
+
+
+def test_arrow_export_of_no_rows_is_a_valid_stream():
+    pa = pytest.importorskip("pyarrow")
+    columns = ("timestamp", "call_id", "caller_number", "caller_name", "call_date", "call_duration")
+
+    body = b"".join(ApiExport(StreamingDatabase([])).arrow_chunks("phone_calls", columns, START, START))
+
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.num_rows == 0
+    assert table.schema.names == list(columns)
+
+
+def test_slot_is_released_when_the_client_leaves_before_the_first_chunk():
+    database = StreamingDatabase([[e320_row(0)]])
+    slots = free_slots()
+
+    response = ApiExport(database).get("e320", "csv", START, START + timedelta(hours=1))
+    assert free_slots() == slots - 1
+
+    async def scenario():
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # the client is gone before the response starts
+            await asyncio.Event().wait()
+
+        await response({"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send)
+
+    asyncio.run(scenario())
+
+    assert free_slots() == slots
+
+
+def test_slot_is_released_once_after_a_full_download():
+    database = StreamingDatabase([[e320_row(0)], [e320_row(1)]])
+    slots = free_slots()
+    sent = []
+
+    response = ApiExport(database).get("e320", "ndjson", START, START + timedelta(hours=1))
+
+    async def scenario():
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await response({"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send)
+
+    asyncio.run(scenario())
+
+    assert len([m for m in sent if m.get("body")]) == 2
+    assert database.closed
+    assert free_slots() == slots
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+from library import call_monitor as call_monitor_module
+from library.call_monitor import CallMonitor
+from library.timerange import LOCAL_TZ
+
+
+class RecordingDatabase():
+    """AsyncDatabase stand-in that keeps the rows the monitor stores."""
+
+    def __init__(self):
+        self.rows = []
+        self.stored = asyncio.Event()
+
+    async def execute_values(self, statement, rows, page_size=500):
+        self.rows.extend(rows)
+        self.stored.set()
+
+
+class FakeCallMonitor():
+    """Local stand-in for the Fritzbox call monitor, one script per connection."""
+
+    def __init__(self, scripts):
+        self.scripts = list(scripts)
+        self.connections = 0
+        self.server = None
+        self.writers = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        lines = self.scripts.pop(0) if self.scripts else []
+        for line in lines:
+            if line is not None:
+                writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+        # a script ending in None keeps the connection open like an idle box
+        if lines and lines[-1] is None:
+            await asyncio.sleep(3600)
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+        await self.server.wait_closed()
+
+
+def monitor_time(value):
+    return value.strftime("%d.%m.%y %H:%M:%S")
+
+
+@pytest.fixture
+def no_lookups(monkeypatch):
+    monkeypatch.setattr(
+        call_monitor_module.Fritzbox, "telefonbuch_reverse_lookup", staticmethod(lambda number, timeout=30: "Erika")
+    )
+
+
+def test_handle_returns_incoming_calls_when_they_end():
+    monitor = CallMonitor(RecordingDatabase(), host="127.0.0.1", port=1)
+    start = dt.now(LOCAL_TZ).replace(microsecond=0)
+
+    assert monitor.handle(f"{monitor_time(start)};RING;0;0301234;5550;SIP0;") is None
+    assert monitor.handle(f"{monitor_time(start)};CONNECT;0;10;0301234;") is None
+    call = monitor.handle(f"{monitor_time(start + timedelta(seconds=95))};DISCONNECT;0;95;")
+    assert call["caller"] == "0301234"
+    assert call["seconds"] == 95
+    assert call["timestamp"] == start
+
+
+def test_handle_ignores_outgoing_and_broken_lines():
+    monitor = CallMonitor(RecordingDatabase(), host="127.0.0.1", port=1)
+    now = monitor_time(dt.now(LOCAL_TZ))
+
+    assert monitor.handle(f"{now};CALL;1;10;5550;0301234;SIP0;") is None
+    assert monitor.handle(f"{now};DISCONNECT;1;30;") is None
+    assert monitor.handle("garbage") is None
+    assert monitor.handle("99.99.99 99:99:99;RING;2;0301234;5550;SIP0;") is None
+    assert monitor.handle(f"{now};DISCONNECT;7;0;") is None
+
+
+def test_monitor_stores_calls_and_reconnects(no_lookups):
+    start = dt.now(LOCAL_TZ).replace(second=10, microsecond=0)
+    end = monitor_time(start + timedelta(seconds=50))
+    scripts = [
+        # the box drops the connection during a call
+        [f"{monitor_time(start)};RING;0;0301234;5550;SIP0;"],
+        [
+            f"{monitor_time(start)};RING;1;0305678;5550;SIP0;",
+            f"{monitor_time(start)};CALL;2;10;5550;0309999;SIP0;",
+            f"{monitor_time(start)};CONNECT;1;10;0305678;",
+            f"{end};DISCONNECT;2;20;",
+            f"{end};DISCONNECT;1;50;",
+            None,
+        ],
+    ]
+
+    async def scenario():
+        fake = FakeCallMonitor(scripts)
+        port = await fake.start()
+        database = RecordingDatabase()
+        monitor = CallMonitor(database, host="127.0.0.1", port=port)
+        task = asyncio.create_task(monitor.run())
+        try:
+            await asyncio.wait_for(database.stored.wait(), 10)
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await fake.close()
+        return fake, database
+
+    fake, database = asyncio.run(scenario())
+
+    assert fake.connections == 2
+    # only the incoming call that ended; the dropped one and the outgoing one are not stored
+    assert database.rows == [
+        (start.replace(second=0), None, "0305678", "Erika", start.strftime("%d.%m.%y %H:%M"), "0:01"),
+    ]
+
+
+def test_phone_run_removes_monitor_rows_stored_twice(database):
+    from jobs.phone import Phone
+    from library.async_database import AsyncDatabase
+
+    timestamp = dt.now(LOCAL_TZ).replace(second=0, microsecond=0)
+    number = "0307070"
+    database.execute('DELETE FROM phone_calls WHERE caller_number = %s;', (number,))
+    insert = database.sql.generate_phone_calls_bulk_insert_stmt()
+    date = timestamp.strftime("%d.%m.%y %H:%M")
+    # the monitor row landed after the Phone run had read the unmatched rows
+    database.execute_values(insert, [(timestamp, 987654, number, None, date, "0:02")])
+    database.execute_values(insert, [(timestamp + timedelta(seconds=30), None, number, "Erika", date, "0:02")])
+
+    asyncio.run(Phone.reconcile_monitored(AsyncDatabase(database), timestamp - timedelta(days=1)))
+
+    rows = database.read(
+        'SELECT call_id, caller_name FROM phone_calls WHERE caller_number = %s;', (number,), primary=True
+    )
+    assert rows == [(987654, "Erika")]
+    database.execute('DELETE FROM phone_calls WHERE caller_number = %s;', (number,))
+
+
+def test_monitor_survives_an_over_long_line_and_a_failing_store(no_lookups):
+    start = dt.now(LOCAL_TZ).replace(second=10, microsecond=0)
+    ring = f"{monitor_time(start)};RING;0;0301234;5550;SIP0;"
+    disconnect = f"{monitor_time(start + timedelta(seconds=30))};DISCONNECT;0;30;"
+    scripts = [
+        # more than the stream reader's 64 KiB line limit
+        ["x" * 70000],
+        [ring, disconnect],
+        [ring, disconnect, None],
+    ]
+
+    async def scenario():
+        fake = FakeCallMonitor(scripts)
+        port = await fake.start()
+        database = RecordingDatabase()
+        monitor = CallMonitor(database, host="127.0.0.1", port=port)
+        stores = []
+        store = monitor.store
+
+        async def failing_once(call):
+            stores.append(call)
+            if len(stores) == 1:
+                raise RuntimeError("store failed")
+            await store(call)
+
+        monitor.store = failing_once
+        task = asyncio.create_task(monitor.run())
+        try:
+            # two reconnects with back-off
+            await asyncio.wait_for(database.stored.wait(), 10)
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await fake.close()
+        return fake, database, stores
+
+    fake, database, stores = asyncio.run(scenario())
+
+    assert fake.connections == 3
+    assert len(stores) == 2
+    assert [row[2] for row in database.rows] == ["0301234"]
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+from jobs import e320 as e320_module
+from jobs.e320 import E320
+from library.e320_telemetry import E320Telemetry
+from library.ring_buffer import RingStore
+from library.timerange import LOCAL_TZ
+
+MINUTE = LOCAL_TZ.localize(dt(2026, 3, 2, 12, 0))
+
+
+def sensor(power, e_in=100.0, e_out=20.0):
+    return json.dumps({"Time": "2026-03-02T12:00:00", "E320": {"E_in": e_in, "E_out": e_out, "Power": power}})
+
+
+class StandInBroker():
+    """
+    Just enough MQTT 3.1.1 for one paho client: accepts the connection,
+    acknowledges the subscription and then publishes the given payloads.
+    """
+
+    def __init__(self, payloads):
+        self.payloads = list(payloads)
+        self.subscriptions = []
+        self.subscribed = threading.Event()
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._server.close()
+        self._thread.join(timeout=5)
+
+    @staticmethod
+    def _read_packet(conn):
+        header = conn.recv(1)
+        if not header:
+            return None, b""
+        length = 0
+        multiplier = 1
+        while True:
+            byte = conn.recv(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        body = b""
+        while len(body) < length:
+            body += conn.recv(length - len(body))
+        return header[0] >> 4, body
+
+    def _serve(self):
+        conn, _ = self._server.accept()
+        with conn:
+            while True:
+                kind, body = self._read_packet(conn)
+                if kind is None or kind == 14:  # DISCONNECT
+                    return
+                if kind == 1:  # CONNECT
+                    conn.sendall(bytes([0x20, 0x02, 0x00, 0x00]))
+                elif kind == 8:  # SUBSCRIBE
+                    topic_length = int.from_bytes(body[2:4], "big")
+                    self.subscriptions.append(body[4:4 + topic_length].decode())
+                    conn.sendall(bytes([0x90, 0x03]) + body[:2] + bytes([0x00]))
+                    topic = self.subscriptions[-1].encode()
+                    for payload in self.payloads:
+                        packet = len(topic).to_bytes(2, "big") + topic + payload.encode()
+                        conn.sendall(bytes([0x30, len(packet)]) + packet)
+                    self.subscribed.set()
+                elif kind == 12:  # PINGREQ
+                    conn.sendall(bytes([0xD0, 0x00]))
+
+
+def test_minute_aggregates_min_max_avg_last():
+    telemetry = E320Telemetry()
+    for second, power in ((5, 300.0), (20, 100.0), (40, 500.0), (55, 200.0)):
+        telemetry.handle(sensor(power, e_in=100.0 + second), MINUTE + timedelta(seconds=second))
+
+    [aggregate] = telemetry.drain(MINUTE + timedelta(minutes=1))
+
+    assert aggregate.timestamp == MINUTE
+    assert aggregate.e_in == 155.0
+    assert aggregate.e_out == 20.0
+    assert aggregate.power == 200.0
+    assert (aggregate.power_min, aggregate.power_max, aggregate.power_avg) == (100.0, 500.0, 275.0)
+    assert aggregate.samples == 4
+
+
+def test_minute_rollover_closes_the_previous_minute():
+    telemetry = E320Telemetry()
+    telemetry.handle(sensor(100.0), MINUTE + timedelta(seconds=50))
+    telemetry.handle(sensor(300.0), MINUTE + timedelta(seconds=70))
+
+    # the running minute stays open until it is over
+    assert [a.timestamp for a in telemetry.drain(MINUTE + timedelta(seconds=80))] == [MINUTE]
+    assert telemetry.drain(MINUTE + timedelta(seconds=80)) == []
+
+    # closed once it is over, even without another reading
+    [aggregate] = telemetry.drain(MINUTE + timedelta(minutes=2))
+    assert aggregate.timestamp == MINUTE + timedelta(minutes=1)
+    assert aggregate.power_avg == 300.0
+
+
+def test_drain_includes_the_running_minute_on_shutdown():
+    telemetry = E320Telemetry()
+    telemetry.handle(sensor(100.0), MINUTE + timedelta(seconds=10))
+
+    assert telemetry.drain(MINUTE + timedelta(seconds=20)) == []
+    [aggregate] = telemetry.drain(MINUTE + timedelta(seconds=20), include_current=True)
+    assert aggregate.samples == 1
+
+
+def test_malformed_payloads_are_skipped():
+    class Message():
+        def __init__(self, payload):
+            self.payload = payload
+
+    telemetry = E320Telemetry()
+    for payload in (b"not json", b'{"Time": "2026-03-02T12:00:00"}', b'{"E320": {"E_in": 1, "E_out": 2, "Power": "n/a"}}'):
+        telemetry._on_message(None, None, Message(payload))
+
+    assert not telemetry.is_fresh()
+    assert telemetry.drain(include_current=True) == []
+    with pytest.raises(ValueError):
+        telemetry.handle(b"not json")
+
+
+def test_rings_record_the_minute_average():
+    telemetry = E320Telemetry()
+    telemetry.handle(sensor(100.0), MINUTE + timedelta(seconds=10))
+    telemetry.handle(sensor(500.0), MINUTE + timedelta(seconds=50))
+    [aggregate] = telemetry.drain(MINUTE + timedelta(minutes=1))
+
+    rings = RingStore()
+    rings.record(aggregate)
+
+    assert rings.between("e320.power", MINUTE, MINUTE + timedelta(minutes=1)) == ([MINUTE.timestamp()], [300.0])
+
+
+def test_connects_subscribes_and_aggregates(monkeypatch):
+    broker = StandInBroker([sensor(100.0), "garbage", sensor(300.0)])
+    broker.start()
+    monkeypatch.setenv("MQTT_HOST", "127.0.0.1")
+    monkeypatch.setenv("MQTT_PORT", str(broker.port))
+    monkeypatch.delenv("MQTT_USER", raising=False)
+    monkeypatch.setenv("E320_MQTT_TOPIC", "tele/test-e320/SENSOR")
+    telemetry = E320Telemetry()
+    telemetry.start()
+    try:
+        assert broker.subscribed.wait(timeout=10)
+        aggregates = []
+        deadline = time.monotonic() + 10
+        while sum(a.samples for a in aggregates) < 2 and time.monotonic() < deadline:
+            aggregates += telemetry.drain(include_current=True)
+            time.sleep(0.05)
+    finally:
+        telemetry.stop()
+        broker.close()
+
+    assert broker.subscriptions == ["tele/test-e320/SENSOR"]
+    assert telemetry.is_fresh()
+    # the garbage in between is skipped
+    assert sum(aggregate.samples for aggregate in aggregates) == 2
+    assert aggregates[-1].power == 300.0
+
+
+class FakeResponse():
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self, content_type="application/json"):
+        return self.data
+
+
+class FakeClientSession():
+    """Records the polled URLs and answers like the Tasmota status endpoint."""
+
+    def __init__(self, power):
+        self.power = power
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return FakeResponse({"StatusSNS": {"E320": {"E_in": 100.0, "E_out": 20.0, "Power": self.power}}})
+
+
+class FakeHttpSession():
+
+    def __init__(self, session):
+        self.session = session
+
+    def get(self):
+        return self.session
+
+
+class RecordingWriteBuffer():
+
+    def __init__(self):
+        self.samples = []
+
+    def add_many(self, samples):
+        self.samples.extend(samples)
+
+
+@pytest.fixture
+def fetch_setup(monkeypatch):
+    telemetry = E320Telemetry()
+    session = FakeClientSession(power=400.0)
+    monkeypatch.setattr(e320_module, "e320_telemetry", telemetry)
+    monkeypatch.setattr(e320_module, "http_session", FakeHttpSession(session))
+    monkeypatch.setattr(e320_module, "rings", RingStore())
+    return telemetry, session, RecordingWriteBuffer()
+
+
+def test_fetch_polls_http_while_the_telemetry_is_stale(fetch_setup):
+    telemetry, session, write_buffer = fetch_setup
+
+    assert asyncio.run(E320.fetch(write_buffer)) == []
+
+    assert session.urls == [E320.URL]
+    # the reading joins the minute aggregate instead of being stored on its own
+    assert write_buffer.samples == []
+    [aggregate] = telemetry.drain(dt.now(LOCAL_TZ) + timedelta(minutes=1))
+    assert (aggregate.power, aggregate.power_avg, aggregate.samples) == (400.0, 400.0, 1)
+
+
+def test_fetch_stores_a_switch_over_minute_once(fetch_setup):
+    telemetry, session, write_buffer = fetch_setup
+    now = dt.now(LOCAL_TZ)
+
+    asyncio.run(E320.fetch(write_buffer))
+    # telemetry resumes within the same minute
+    telemetry.handle(sensor(200.0), now)
+    asyncio.run(E320.fetch(write_buffer))
+
+    assert session.urls == [E320.URL]
+    aggregates = write_buffer.samples + telemetry.drain(now + timedelta(minutes=2))
+    minute = now.replace(second=0, microsecond=0)
+    assert [a.timestamp for a in aggregates if a.timestamp == minute] == [minute]
+    assert sum(a.samples for a in aggregates) == 2
+
+
+def test_rollup_uses_the_minute_average(database):
+    from library.rollup import Rollup
+    from library.samples import E320Sample
+
+    hour = (dt.now(LOCAL_TZ) - timedelta(days=1)).replace(hour=3, minute=0, second=0, microsecond=0)
+    database.execute('DELETE FROM "e320" WHERE "timestamp" >= %s AND "timestamp" < %s;', (hour, hour + timedelta(hours=1)))
+    insert = database.sql.generate_bulk_insert_stmt("e320", E320Sample._fields)
+    database.execute_values(insert, [
+        # "power" is the last reading of each minute, the rollup wants the average
+        E320Sample(hour + timedelta(minutes=1), 100.0, 20.0, 900.0, 100.0, 900.0, 300.0, 6),
+        E320Sample(hour + timedelta(minutes=2), 100.0, 20.0, 100.0, 100.0, 900.0, 500.0, 6),
+        # a plain HTTP row from before the telemetry
+        E320Sample(hour + timedelta(minutes=3), 100.0, 20.0, 400.0),
+    ])
+
+    Rollup.run(database)
+
+    rows = database.read(
+        'SELECT "min", "max", "sum", "count" FROM "rollup_hourly" WHERE "source" = %s AND "metric" = %s AND "bucket" = %s;',
+        ("e320", "power", hour), primary=True,
+    )
+    assert rows == [(300.0, 500.0, 1200.0, 3)]
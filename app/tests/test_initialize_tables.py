@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from library.sql import Sql
+
+
+def test_failed_statement_leaves_tables_uninitialized(database, monkeypatch):
+    from library.database import Database
+
+    fresh = Database()
+    try:
+        with monkeypatch.context() as patch:
+            patch.setattr(Sql, "generate_devices_index_stmt", lambda self: "CREATE INDEX broken ON missing_table (x);")
+            assert Database.initialize_tables(fresh) is False
+            assert not fresh.initialized
+
+        # retried, e.g. by the spool replay, once the statement works
+        assert Database.initialize_tables(fresh) is True
+        assert fresh.initialized
+    finally:
+        fresh.close()
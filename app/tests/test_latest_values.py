@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime as dt, timedelta
+
+from library import polling
+from library.latest_values import LatestValues
+from library.polling import AdaptiveJob, SolarPolicy
+from library.samples import SolarpanelSample
+
+
+class NightTime():
+
+    def refresh(self):
+        pass
+
+    def is_daylight(self, now=None):
+        return False
+
+
+class RecordingScheduler():
+
+    def __init__(self):
+        self.intervals = []
+
+    def add_job(self, func, trigger, seconds=None, **kwargs):
+        self.intervals.append(seconds)
+
+    def reschedule_job(self, job_id, trigger=None, seconds=None, jitter=None):
+        self.intervals.append(seconds)
+
+
+def solar_sample(age):
+    return SolarpanelSample(dt.now().astimezone() - timedelta(seconds=age), 12.0, 1, 0.0)
+
+
+def test_night_polling_does_not_make_solar_values_stale(monkeypatch):
+    values = LatestValues()
+    monkeypatch.setattr(polling, "latest_values", values)
+
+    async def fetch():
+        return solar_sample(0)
+
+    scheduler = RecordingScheduler()
+    job = AdaptiveJob(scheduler, "home_automation", SolarPolicy(NightTime()), fetch, table=SolarpanelSample.table)
+    job.add(jitter=10)
+    assert values.describe(solar_sample(600))["stale"]
+
+    asyncio.run(job.run())
+
+    assert scheduler.intervals == [60, 900]
+    assert not values.describe(solar_sample(1200))["stale"]
+    # two night polls missed
+    assert values.describe(solar_sample(1900))["stale"]
+
+
+def test_errors_do_not_stretch_the_expected_interval(monkeypatch):
+    values = LatestValues()
+    monkeypatch.setattr(polling, "latest_values", values)
+
+    async def fetch():
+        return None
+
+    job = AdaptiveJob(RecordingScheduler(), "home_automation", SolarPolicy(NightTime()), fetch, table=SolarpanelSample.table)
+    job.add()
+    for _ in range(3):
+        asyncio.run(job.run())
+
+    assert job.seconds == 1800
+    assert values.max_age(SolarpanelSample.table) == 2 * 900 + LatestValues.GRACE_SECONDS
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime as dt
+
+import pytest
+
+from library.partitions import Partitions
+from library.sql import Statement
+from library.timerange import LOCAL_TZ, today_bounds
+
+
+RANGE_QUERIES = {
+    "solarpanel_range": "solarpanels",
+    "e320_range": "e320",
+    "phone_calls_range": "phone_calls",
+}
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+@pytest.mark.parametrize("name,table", RANGE_QUERIES.items())
+def test_range_query_scans_the_covering_index_of_one_partition(database, name, table):
+    statement = Statement(name, today_bounds())
+    with database.cursor() as cur:
+        # The test tables are tiny; with sequential scans ruled out the plan
+        # shows whether the bounds can drive the index. DATE("timestamp") =
+        # current_date only ever got a filter over every partition's index.
+        cur.execute("SET LOCAL enable_seqscan = off;")
+        cur.execute("SET LOCAL enable_bitmapscan = off;")
+        database.run(cur, statement)
+        cur.fetchall()
+        cur.execute("EXPLAIN (FORMAT JSON) " + statement.execute_stmt(), statement.params)
+        plan = cur.fetchone()[0][0]["Plan"]
+        scans = [node for node in plan_nodes(plan) if "Relation Name" in node]
+        # partitions get their own copy of the index, named by Postgres
+        cur.execute(
+            "SELECT DISTINCT i.inhparent::regclass::text FROM pg_inherits i WHERE i.inhrelid = ANY(%s::regclass[]);",
+            ([node.get("Index Name") or "" for node in scans],),
+        )
+        parent_indexes = {row[0] for row in cur.fetchall()}
+
+    assert scans
+    assert {node["Node Type"] for node in scans} == {"Index Only Scan"}
+    assert all("Index Cond" in node and "Filter" not in node for node in scans)
+    assert parent_indexes == {"{}_timestamp_covering".format(table)}
+    # the bounds prune every partition but today's
+    today = Partitions.partition_name(table, dt.now(LOCAL_TZ).date())
+    assert {node["Relation Name"] for node in scans} == {today}
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+
+
+def test_unreachable_replica_does_not_hold_up_reads(database, monkeypatch):
+    from library.database import Database
+
+    # accepts connections but never answers, like a hung standby
+    silent = socket.create_server(("127.0.0.1", 0))
+    monkeypatch.setenv("POSTGRES_READ_REPLICAS", "127.0.0.1:{}".format(silent.getsockname()[1]))
+    monkeypatch.setenv("POSTGRES_REPLICA_CONNECT_TIMEOUT", "2")
+    replicated = Database()
+    [replica] = replicated.replicas
+    try:
+        started = time.monotonic()
+        for _ in range(3):
+            assert replicated.read("SELECT 1;") == [(1,)]
+        # served by the primary while the probe waits for its connect timeout
+        assert time.monotonic() - started < 1
+        assert replica.probing
+
+        deadline = time.monotonic() + 10
+        while replica.probing and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not replica.probing
+        assert replica.lag is None
+        assert replica.pool is None
+    finally:
+        replicated.close()
+        silent.close()
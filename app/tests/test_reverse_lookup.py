@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+from datetime import datetime as dt, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from library import reverse_lookup as lookup_module
+from library.reverse_lookup import ReverseLookup, normalize_number
+from library.timerange import LOCAL_TZ
+
+
+HIT_PAGE = """<html><head><title>Das Telefonbuch</title></head><body>
+<div class="result"><div class="name">Erika Mustermann</div></div>
+</body></html>"""
+
+EMPTY_PAGE = "<html><head><title>Das Telefonbuch</title></head><body>Keine Treffer</body></html>"
+
+
+class FixtureServer():
+    """Local stand-in for the reverse search: number -> (status, page)."""
+
+    def __init__(self):
+        self.answers = {}
+        self.requests = []
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                number = form["phone"][0]
+                fixture.requests.append(number)
+                status, page = fixture.answers.get(number, (404, ""))
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "60")
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.end_headers()
+                self.wfile.write(page.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/Rueckwaerts-Suche".format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fixture_server():
+    server = FixtureServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def lookup(fixture_server, tmp_path):
+    return ReverseLookup(url=fixture_server.url, cache_path=str(tmp_path / "lookups.sqlite3"))
+
+
+def test_normalize_number():
+    assert normalize_number("+49 30 1234-56") == "030123456"
+    assert normalize_number("0049301234") == "0301234"
+    assert normalize_number(" 030/1234 ") == "0301234"
+    assert normalize_number(None) == ""
+
+
+def test_hit_is_cached(fixture_server, lookup):
+    fixture_server.answers["0301234"] = (200, HIT_PAGE)
+
+    assert lookup.lookup("+49 30 1234") == "Erika Mustermann"
+    assert lookup.lookup("030 1234") == "Erika Mustermann"
+    assert fixture_server.requests == ["0301234"]
+
+
+def test_miss_is_cached(fixture_server, lookup):
+    fixture_server.answers["0305555"] = (200, EMPTY_PAGE)
+
+    assert lookup.lookup("0305555") == ""
+    assert lookup.lookup("0305555") == ""
+    # unknown numbers answer 404
+    assert lookup.lookup("0306666") == ""
+    assert lookup.lookup("0306666") == ""
+    assert fixture_server.requests == ["0305555", "0306666"]
+
+
+def test_server_errors_are_retried(fixture_server, lookup):
+    fixture_server.answers["0307777"] = (500, "")
+
+    assert lookup.lookup("0307777") is None
+    fixture_server.answers["0307777"] = (200, HIT_PAGE)
+    assert lookup.lookup("0307777") == "Erika Mustermann"
+    assert fixture_server.requests == ["0307777", "0307777"]
+
+
+def test_rate_limited_by_server_pauses_lookups(fixture_server, lookup):
+    fixture_server.answers["0308888"] = (429, "")
+
+    assert lookup.lookup("0308888") is None
+    # paused for Retry-After, nothing is sent and nothing is cached
+    assert lookup.lookup("0309999", timeout=0) is None
+    assert fixture_server.requests == ["0308888"]
+    cached, _ = lookup.cache.get("0308888", lookup.hit_ttl, lookup.miss_ttl)
+    assert not cached
+
+
+def test_token_bucket_limits_lookups(fixture_server, lookup):
+    lookup.bucket = lookup_module.TokenBucket(rate=0.001, capacity=2)
+
+    assert lookup.lookup("0301001", timeout=0) == ""
+    assert lookup.lookup("0301002", timeout=0) == ""
+    assert lookup.lookup("0301003", timeout=0) is None
+    assert fixture_server.requests == ["0301001", "0301002"]
+
+
+def test_phone_resolves_names_left_null(database, fixture_server, lookup, monkeypatch):
+    from jobs.phone import Phone
+    from library.async_database import AsyncDatabase
+
+    fixture_server.answers["0304242"] = (500, "")
+    monkeypatch.setattr(lookup_module, "reverse_lookup", lookup)
+    monkeypatch.setattr("library.fritzbox.reverse_lookup", lookup)
+    timestamp = dt.now(LOCAL_TZ).replace(second=0, microsecond=0)
+    database.execute('DELETE FROM phone_calls WHERE caller_number = %s;', ("0304242",))
+    database.execute_values(
+        database.sql.generate_phone_calls_bulk_insert_stmt(),
+        [(timestamp, None, "0304242", None, timestamp.strftime("%d.%m.%y %H:%M"), "0:01")],
+    )
+    since = timestamp - timedelta(days=1)
+    names = 'SELECT caller_name FROM phone_calls WHERE caller_number = %s;'
+
+    # the site fails: the name stays NULL for the next run
+    asyncio.run(Phone.resolve_names(AsyncDatabase(database), since))
+    assert database.read(names, ("0304242",), primary=True) == [(None,)]
+
+    fixture_server.answers["0304242"] = (200, HIT_PAGE)
+    asyncio.run(Phone.resolve_names(AsyncDatabase(database), since))
+    assert database.read(names, ("0304242",), primary=True) == [("Erika Mustermann",)]
+    database.execute('DELETE FROM phone_calls WHERE caller_number = %s;', ("0304242",))
+
+
+class CallStore():
+    """AsyncDatabase stand-in without stored calls that keeps the inserted rows."""
+
+    def __init__(self):
+        self.rows = []
+
+    async def read(self, select_statement, params=None, primary=False):
+        return []
+
+    async def execute_values(self, insert_statement, rows, page_size=500):
+        self.rows.extend(rows)
+
+
+def test_phone_stores_a_burst_of_unknown_callers_without_waiting(fixture_server, lookup, monkeypatch):
+    from jobs.phone import Phone
+
+    monkeypatch.setattr("library.fritzbox.reverse_lookup", lookup)
+    timestamp = dt.now(LOCAL_TZ).replace(second=0, microsecond=0)
+    calls = {
+        call_id: (timestamp, {
+            "caller": "030500{:02d}".format(call_id), "name": "", "date": "", "duration": "0:01",
+        })
+        for call_id in range(30)
+    }
+    calls[99] = (timestamp, {"caller": "0305099", "name": "Erika", "date": "", "duration": "0:01"})
+    calls[98] = (timestamp, {"caller": "", "name": "", "date": "", "duration": "0:01"})
+    database = CallStore()
+
+    asyncio.run(asyncio.wait_for(Phone.store_calls(database, calls, timestamp - timedelta(days=1)), 5))
+
+    # no lookups: the names stay NULL for resolve_names, known ones are kept
+    assert fixture_server.requests == []
+    names = {row[1]: row[3] for row in database.rows}
+    assert len(names) == 32
+    assert all(names[call_id] is None for call_id in range(30))
+    assert names[99] == "Erika"
+    assert names[98] == ""
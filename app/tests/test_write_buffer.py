@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+from datetime import datetime as dt, timedelta
+
+from library.samples import E320Sample
+from library.spool import Spool
+from library.timerange import LOCAL_TZ
+from library.write_buffer import WriteBuffer
+
+
+def test_rejected_rows_are_quarantined_instead_of_requeued(database, tmp_path):
+    spool = Spool(str(tmp_path / "spool.sqlite3"))
+    buffer = WriteBuffer(database, spool)
+    minute = dt.now(LOCAL_TZ).replace(second=0, microsecond=0) - timedelta(hours=2)
+    database.execute('DELETE FROM "e320" WHERE "timestamp" >= %s AND "timestamp" < %s;', (minute, minute + timedelta(minutes=3)))
+    # no partition exists for the second sample
+    poison = E320Sample(LOCAL_TZ.localize(dt(2000, 1, 1)), 1.0, 2.0, 3.0)
+
+    buffer.add_many([E320Sample(minute, 1.0, 2.0, 3.0), poison, E320Sample(minute + timedelta(minutes=1), 1.0, 2.0, 4.0)])
+    buffer.flush()
+
+    assert buffer._count == 0
+    assert spool.pending() == 0
+    assert spool.quarantined() == 1
+    with sqlite3.connect(spool.path) as conn:
+        [(sample_type, error)] = conn.execute("SELECT sample_type, error FROM quarantine").fetchall()
+    assert sample_type == "E320Sample"
+    assert "partition" in error
+
+    # the next flush is not held up by the rejected row
+    buffer.add(E320Sample(minute + timedelta(minutes=2), 1.0, 2.0, 5.0))
+    buffer.flush()
+    rows = database.read(
+        'SELECT "power" FROM "e320" WHERE "timestamp" >= %s AND "timestamp" < %s ORDER BY "timestamp";',
+        (minute, minute + timedelta(minutes=3)), primary=True,
+    )
+    assert rows == [(3.0,), (4.0,), (5.0,)]
+    database.execute('DELETE FROM "e320" WHERE "timestamp" >= %s AND "timestamp" < %s;', (minute, minute + timedelta(minutes=3)))